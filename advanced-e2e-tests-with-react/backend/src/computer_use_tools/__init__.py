@@ -15,16 +15,18 @@
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 from .base import CLIResult, ToolResult
-from .bash import BashTool
-from .collection import ToolCollection
+from .bash import BashSessionPool, BashTool
+from .collection import ToolCollection, ToolScheduler
 from .computer import ComputerTool
 from .edit import EditTool
 
 __ALL__ = [
+    BashSessionPool,
     BashTool,
     CLIResult,
     ComputerTool,
     EditTool,
     ToolCollection,
     ToolResult,
+    ToolScheduler,
 ]
@@ -0,0 +1,86 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+
+DEFAULT_ARCHIVE_LIMIT = 0  # archiving is off unless SCREENSHOT_ARCHIVE_LIMIT is set
+MAX_PENDING_WRITES = 32
+
+
+class ScreenshotArchiver:
+    """
+    Writes screenshots to disk on a background thread and keeps only the newest
+    `max_files` of them. When the writer falls behind, new screenshots are dropped
+    instead of blocking the test that took them.
+    """
+
+    def __init__(self, output_dir: str, max_files: int):
+        self.output_dir = Path(output_dir)
+        self.max_files = max_files
+        self._pending: queue.Queue[tuple[str, bytes]] = queue.Queue(MAX_PENDING_WRITES)
+        self._written: deque[Path] = deque()
+        self._thread = threading.Thread(
+            target=self._run, name="screenshot-archiver", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, name: str, png: bytes) -> bool:
+        """Queue a screenshot for writing; return False if it was dropped."""
+        try:
+            self._pending.put_nowait((name, png))
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self):
+        self._cleanup()
+        while True:
+            name, png = self._pending.get()
+            path = self.output_dir / name
+            try:
+                path.write_bytes(png)
+            except OSError:
+                continue
+            self._written.append(path)
+            while len(self._written) > self.max_files:
+                self._written.popleft().unlink(missing_ok=True)
+
+    def _cleanup(self):
+        """Start every run from an empty directory."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for file in self.output_dir.iterdir():
+            if file.is_file():
+                file.unlink(missing_ok=True)
+
+
+_archiver: ScreenshotArchiver | None = None
+_archiver_lock = threading.Lock()
+
+
+def get_archiver(output_dir: str) -> ScreenshotArchiver | None:
+    """Return the process-wide archiver, or None when archiving is disabled."""
+    global _archiver
+    max_files = int(os.getenv("SCREENSHOT_ARCHIVE_LIMIT", DEFAULT_ARCHIVE_LIMIT))
+    if max_files <= 0:
+        return None
+    with _archiver_lock:
+        if _archiver is None:
+            _archiver = ScreenshotArchiver(output_dir, max_files)
+    return _archiver
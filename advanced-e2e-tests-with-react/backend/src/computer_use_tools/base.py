@@ -20,6 +20,9 @@ from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+# concurrency key of everything that touches the filesystem; "workspace:<path>" covers one file
+WORKSPACE_KEY = "workspace"
+
 
 class BaseAnthropicTool(metaclass=ABCMeta):
     """Abstract base class for Anthropic-defined tools."""
@@ -35,6 +38,14 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    def concurrency_key(self, tool_input: dict[str, Any]) -> str:
+        """
+        Calls with the same key run one after another, in order; calls with
+        different keys may overlap. A key also stays ordered with the keys nested
+        under it, "a" with "a:b". By default every call of a tool shares a key.
+        """
+        return self.to_params()["name"]
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -43,6 +54,7 @@ class ToolResult:
     output: str | None = None
     error: str | None = None
     base64_image: str | None = None
+    media_type: str | None = None
     system: str | None = None
 
     def __bool__(self):
@@ -62,6 +74,7 @@ class ToolResult:
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            media_type=combine_fields(self.media_type, other.media_type, False),
             system=combine_fields(self.system, other.system),
         )
 
@@ -15,12 +15,64 @@
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import contextlib
 import os
-from typing import ClassVar, Literal
+import shutil
+import signal
+import tempfile
+from typing import Any, ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .base import WORKSPACE_KEY, BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .run import MAX_RESPONSE_LEN, TRUNCATED_MESSAGE
+
+
+class _SentinelReader:
+    """
+    Collects a stream up to a sentinel line, keeping only the first `limit` bytes.
+    What has been read stays available if the read is cancelled part way.
+    """
+
+    def __init__(self, sentinel: bytes, limit: int, read_size: int):
+        self._sentinel = sentinel
+        self._limit = limit
+        self._read_size = read_size
+        self._kept = bytearray()
+        # the last bytes read, which may hold the start of the sentinel
+        self._pending = b""
+        self._truncated = False
+
+    async def read(self, stream: asyncio.StreamReader) -> bool:
+        """Read until the sentinel line; return False if the stream ended first."""
+        while True:
+            chunk = await stream.read(self._read_size)
+            if not chunk:
+                return False
+            self._pending += chunk
+            end = self._pending.find(self._sentinel)
+            if end != -1:
+                self._keep(self._pending[:end])
+                self._pending = b""
+                return True
+            end = max(len(self._pending) - len(self._sentinel) + 1, 0)
+            self._keep(self._pending[:end])
+            self._pending = self._pending[end:]
+
+    def text(self) -> str:
+        # a read that did not find the sentinel still holds its last bytes
+        self._keep(self._pending)
+        self._pending = b""
+        output = self._kept.decode(errors="replace")
+        if output.endswith("\n"):
+            output = output[:-1]
+        return output + TRUNCATED_MESSAGE if self._truncated else output
+
+    def _keep(self, data: bytes):
+        room = self._limit - len(self._kept)
+        if len(data) > room:
+            self._truncated = True
+        self._kept += data[:room]
 
 
 class _BashSession:
@@ -30,18 +82,28 @@ class _BashSession:
     _process: asyncio.subprocess.Process
 
     command: str = "/bin/bash"
-    _output_delay: float = 0.2  # seconds
+    _read_size: int = 64 * 1024  # bytes
     _timeout: float = 120.0  # seconds
+    _stderr_grace: float = 1.0  # seconds to wait for stderr's sentinel once stdout's is read
+    _exit_grace: float = 1.0  # seconds to wait for the exit status once stdout is closed
+    _stop_timeout: float = 5.0  # seconds to wait for the shell to exit before killing it
     _sentinel: str = "<<exit>>"
+    _truncate_after: int = MAX_RESPONSE_LEN  # bytes kept per stream
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None, isolate_cwd: bool = False):
         self._started = False
         self._timed_out = False
+        self._stderr_lost = False
+        self._env = env
+        self._isolate_cwd = isolate_cwd
+        self._cwd: str | None = None
 
     async def start(self):
         if self._started:
             return
 
+        if self._isolate_cwd:
+            self._cwd = tempfile.mkdtemp(prefix="bash-session-")
         self._process = await asyncio.create_subprocess_shell(
             self.command,
             preexec_fn=os.setsid,
@@ -50,17 +112,40 @@ class _BashSession:
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            cwd=self._cwd,
+            env={**os.environ, **self._env} if self._env else None,
         )
 
         self._started = True
 
-    def stop(self):
-        """Terminate the bash shell."""
+    @property
+    def healthy(self) -> bool:
+        """Whether the shell can still run commands."""
+        return (
+            self._started
+            and self._process.returncode is None
+            and not self._timed_out
+            and not self._stderr_lost
+        )
+
+    async def stop(self):
+        """Terminate the bash shell, with every process it started, and wait for it."""
         if not self._started:
             raise ToolError("Session has not started.")
-        if self._process.returncode is not None:
-            return
-        self._process.terminate()
+        # the shell runs in a session of its own: signal the whole group, the
+        # /bin/sh that started bash does not forward the signal
+        try:
+            os.killpg(self._process.pid, signal.SIGTERM)
+            await asyncio.wait_for(self._process.wait(), self._stop_timeout)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(self._process.pid, signal.SIGKILL)
+            await self._process.wait()
+        if self._cwd is not None:
+            shutil.rmtree(self._cwd, ignore_errors=True)
+            self._cwd = None
 
     async def run(self, command: str):
         """Execute a command in the bash shell."""
@@ -75,84 +160,187 @@ class _BashSession:
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             )
+        if self._stderr_lost:
+            raise ToolError("bash no longer writes to stderr and must be restarted")
 
         # we know these are not None because we created the process with PIPEs
         assert self._process.stdin
         assert self._process.stdout
         assert self._process.stderr
 
-        # send command to the process
+        # send command to the process; the sentinel marks the end of its output,
+        # on stderr first so that it is already written once stdout's arrives
         self._process.stdin.write(
-            command.encode() + f"; echo '{self._sentinel}'\n".encode()
+            command.encode()
+            + f"; echo '{self._sentinel}' >&2; echo '{self._sentinel}'\n".encode()
         )
         await self._process.stdin.drain()
 
-        # read output from the process, until the sentinel is found
+        # read output from the process as it arrives, until the sentinel is found
+        sentinel = f"{self._sentinel}\n".encode()
+        output = _SentinelReader(sentinel, self._truncate_after, self._read_size)
+        error = _SentinelReader(sentinel, self._truncate_after, self._read_size)
+        error_task = asyncio.create_task(error.read(self._process.stderr))
         try:
             async with asyncio.timeout(self._timeout):
-                while True:
-                    await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
-                        # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
-                        break
+                if not await output.read(self._process.stdout):
+                    # stdout closes as bash exits, its status may not be known yet
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._process.wait(), self._exit_grace)
+                    raise ToolError(
+                        f"bash has exited with returncode {self._process.returncode}"
+                    )
+            # stderr's sentinel was written before stdout's, so it is already in
+            # the pipe, unless stderr was redirected away (exec 2>/dev/null)
+            done, _ = await asyncio.wait([error_task], timeout=self._stderr_grace)
+            if not done:
+                # what the command writes to stderr from now on would be
+                # reported by a later command, so the shell is not reused
+                self._stderr_lost = True
         except asyncio.TimeoutError:
             self._timed_out = True
             raise ToolError(
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
+        finally:
+            error_task.cancel()
 
-        if output.endswith("\n"):
-            output = output[:-1]
+        if self._stderr_lost:
+            return CLIResult(
+                output=output.text(),
+                error=error.text(),
+                system="bash no longer writes to stderr, the tool must be restarted",
+            )
+        return CLIResult(output=output.text(), error=error.text())
 
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-        if error.endswith("\n"):
-            error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
+class BashSessionPool:
+    """
+    Keeps `size` bash shells started ahead of time.
+    A checked-out session belongs to the caller, who stops it when done; the pool
+    starts its replacement in the background, so neither a new test nor a restart
+    waits for bash to spawn. Sessions share `env` on top of the current environment
+    and, with `isolate_cwd`, each start in a temporary directory of their own.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        env: dict[str, str] | None = None,
+        isolate_cwd: bool = False,
+    ):
+        if size < 1:
+            raise ValueError("BashSessionPool size must be at least 1.")
+        self.size = size
+        self.env = env
+        self.isolate_cwd = isolate_cwd
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._spawns: set[asyncio.Task] = set()
+        self._started = False
+        self._closed = False
+
+    async def start(self):
+        """Start every session of the pool in parallel."""
+        if self._started:
+            return
+        self._started = True
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
 
-        return CLIResult(output=output, error=error)
+    async def acquire(self) -> _BashSession:
+        """Check out a running session and start another one in its place."""
+        if self._closed:
+            raise RuntimeError("BashSessionPool is closed.")
+        await self.start()
+        while True:
+            session = await self._idle.get()
+            self._replace()
+            if isinstance(session, Exception):
+                raise session
+            if session.healthy:
+                return session
+            await session.stop()
+
+    async def close(self):
+        """Stop every idle session; sessions still checked out are stopped by their owners."""
+        self._closed = True
+        # a spawn cancelled part way could leave its shell running: let them
+        # finish, those still starting stop their session themselves
+        await asyncio.gather(*self._spawns, return_exceptions=True)
+        sessions = []
+        while not self._idle.empty():
+            session = self._idle.get_nowait()
+            if not isinstance(session, Exception):
+                sessions.append(session)
+        await asyncio.gather(*(session.stop() for session in sessions))
+
+    def _replace(self):
+        task = asyncio.create_task(self._spawn())
+        self._spawns.add(task)
+        task.add_done_callback(self._spawns.discard)
+
+    async def _spawn(self):
+        session = _BashSession(env=self.env, isolate_cwd=self.isolate_cwd)
+        try:
+            await session.start()
+        except Exception as e:
+            self._idle.put_nowait(e)
+            return
+        if self._closed:
+            await session.stop()
+            return
+        self._idle.put_nowait(session)
 
 
 class BashTool(BaseAnthropicTool):
     """
     A tool that allows the agent to run bash commands.
     The tool parameters are defined by Anthropic and are not editable.
+    Sessions are checked out from `pool` when one is given, and started on demand otherwise.
     """
 
     _session: _BashSession | None
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
+    def __init__(self, pool: BashSessionPool | None = None):
         self._session = None
+        self._pool = pool
         super().__init__()
 
     async def __call__(
         self, command: str | None = None, restart: bool = False, **kwargs
     ):
         if restart:
-            if self._session:
-                self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+            await self.close()
+            self._session = await self._new_session()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await self._new_session()
 
         if command is not None:
             return await self._session.run(command)
 
         raise ToolError("no command provided.")
 
+    def concurrency_key(self, tool_input: dict[str, Any]) -> str:
+        # a command can touch any file, so it stays ordered with every edit
+        return WORKSPACE_KEY
+
+    async def close(self):
+        """Stop the current session, if any."""
+        if self._session:
+            session, self._session = self._session, None
+            await session.stop()
+
+    async def _new_session(self) -> _BashSession:
+        if self._pool is not None:
+            return await self._pool.acquire()
+        session = _BashSession()
+        await session.start()
+        return session
+
     def to_params(self) -> BetaToolBash20241022Param:
         return {
             "type": self.api_type,
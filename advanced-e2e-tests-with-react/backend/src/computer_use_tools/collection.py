@@ -14,10 +14,12 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .. import instrumentation
 from .base import (
     BaseAnthropicTool,
     ToolError,
@@ -25,6 +27,9 @@ from .base import (
     ToolResult,
 )
 
+# tool calls of a single turn running at the same time
+DEFAULT_MAX_CONCURRENCY = 4
+
 
 class ToolCollection:
     """A collection of anthropic-defined tools."""
@@ -38,11 +43,67 @@ class ToolCollection:
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
+    def concurrency_key(self, name: str, tool_input: dict[str, Any]) -> str:
+        tool = self.tool_map.get(name)
+        return tool.concurrency_key(tool_input) if tool else name
+
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
-        try:
-            return await tool(**tool_input)
-        except ToolError as e:
-            return ToolFailure(error=e.message)
+        action = tool_input.get("action") or tool_input.get("command")
+        with instrumentation.span("tool", tool=name, action=action) as tool_span:
+            try:
+                result = await tool(**tool_input)
+            except ToolError as e:
+                result = ToolFailure(error=e.message)
+            tool_span.set(failed=bool(result.error), image=bool(result.base64_image))
+            return result
+
+
+def _keys_overlap(a: str, b: str) -> bool:
+    """Whether calls with these concurrency keys must stay ordered."""
+    return a == b or a.startswith(f"{b}:") or b.startswith(f"{a}:")
+
+
+class ToolScheduler:
+    """
+    Starts tool calls as they are submitted. Calls with the same concurrency key,
+    such as every browser action, run one after another in submission order, and
+    so do calls where one key is nested under the other, such as a bash command
+    and an edit; independent calls overlap, at most `max_concurrency` at a time.
+    """
+
+    def __init__(
+        self,
+        tool_collection: ToolCollection,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    ):
+        self._tool_collection = tool_collection
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tails: dict[str, asyncio.Task[ToolResult]] = {}
+
+    def submit(self, name: str, tool_input: dict[str, Any]) -> asyncio.Task[ToolResult]:
+        key = self._tool_collection.concurrency_key(name, tool_input)
+        related = [tail_key for tail_key in self._tails if _keys_overlap(tail_key, key)]
+        previous = [self._tails[tail_key] for tail_key in related]
+        task = asyncio.create_task(self._run_after(previous, name, tool_input))
+        # the new task waits on every related tail, so later calls only need to wait on it
+        # and on the keys it is nested under
+        for tail_key in related:
+            if tail_key.startswith(f"{key}:"):
+                del self._tails[tail_key]
+        self._tails[key] = task
+        return task
+
+    async def _run_after(
+        self,
+        previous: list[asyncio.Task[ToolResult]],
+        name: str,
+        tool_input: dict[str, Any],
+    ) -> ToolResult:
+        if previous:
+            # wait without raising: a failed earlier call must not cancel this one
+            await asyncio.wait(previous)
+        async with self._semaphore:
+            return await self._tool_collection.run(name=name, tool_input=tool_input)
@@ -14,34 +14,48 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import asyncio
 import base64
 import os
-from pathlib import Path
+from enum import StrEnum
+from functools import cache
 from typing import Literal, TypedDict
 from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
+from .. import instrumentation
+from .archive import get_archiver
 from .base import BaseAnthropicTool, ToolError, ToolResult
-from src.driver.manager import WebDriverSingleton
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.keys import Keys
+from .imaging import DuplicateFilter, ImagePipeline, RegionDiffer
+from .settle import PageSettleDetector
 
 OUTPUT_DIR = "./tests/screenshots"
 
+UNCHANGED_SCREEN_MESSAGE = "The screen has not changed since the last screenshot."
+CROP_MESSAGE = (
+    "Only part of the screen changed. The image shows the region from ({0}, {1}) "
+    "to ({2}, {3}); the rest of the screen is as in the previous screenshots."
+)
+
 TYPING_DELAY_MS = 12
 TYPING_GROUP_SIZE = 50
 
-KEY_MAP = {
-    "return": Keys.ENTER,
-    "tab": Keys.TAB,
-    "space": Keys.SPACE,
-    "backspace": Keys.BACKSPACE,
-    "escape": Keys.ESCAPE,
-    "page_down": Keys.PAGE_DOWN,
-    "page_up": Keys.PAGE_UP,
-}
+
+@cache
+def get_key_map() -> dict[str, str]:
+    """Key names Claude uses, mapped to selenium keys; selenium is only imported once a key is sent."""
+    from selenium.webdriver.common.keys import Keys
+
+    return {
+        "return": Keys.ENTER,
+        "tab": Keys.TAB,
+        "space": Keys.SPACE,
+        "backspace": Keys.BACKSPACE,
+        "escape": Keys.ESCAPE,
+        "page_down": Keys.PAGE_DOWN,
+        "page_up": Keys.PAGE_UP,
+    }
+
 
 Action = Literal[
     "key",
@@ -55,6 +69,11 @@ Action = Literal[
     "cursor_position",
 ]
 
+class ScalingSource(StrEnum):
+    COMPUTER = "computer"
+    API = "api"
+
+
 class ComputerToolOptions(TypedDict):
     display_height_px: int
     display_width_px: int
@@ -77,24 +96,30 @@ class ComputerTool(BaseAnthropicTool):
     display_num: int | None
     mouse_coordinates: tuple[int, int] | None = (0,0)
 
-    _screenshot_delay = 2.0
-    _scaling_enabled = False
-    _web_driver = WebDriverSingleton.get_driver()
-    _actions = ActionChains(_web_driver)
+    _screenshot_delay = 2.0  # upper bound on waiting for the page to settle
 
     @property
     def options(self) -> ComputerToolOptions:
+        # the model works in the coordinates of the screenshots it is sent
+        width, height = self._image_size
         return {
-            "display_width_px": self.width,
-            "display_height_px": self.height,
+            "display_width_px": width,
+            "display_height_px": height,
             "display_number": self.display_num,
         }
 
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self):
+    def __init__(self, web_driver):
         super().__init__()
+        # the browser session is checked out from a WebDriverPool by the caller
+        self._web_driver = web_driver
+        # imported here so importing the tools does not load the whole selenium package
+        from selenium.webdriver.common.action_chains import ActionChains
+
+        self._action_chains = ActionChains
+        self._actions = ActionChains(self._web_driver)
         viewport = self._web_driver.execute_script("""
             return {width: window.innerWidth, height: window.innerHeight};
         """)
@@ -105,8 +130,13 @@ class ComputerTool(BaseAnthropicTool):
             self.display_num = int(display_num)
         else:
             self.display_num = 1
-        
-        self._cleanup_screenshot_dir()
+
+        self._archiver = get_archiver(OUTPUT_DIR)
+        self._pipeline = ImagePipeline.from_env()
+        self._image_size = self._pipeline.scaled_size(self.width, self.height)
+        self._duplicates = DuplicateFilter.from_env()
+        self._differ = RegionDiffer.from_env()
+        self.settle = PageSettleDetector(timeout=self._screenshot_delay)
 
     async def __call__(
         self,
@@ -123,6 +153,8 @@ class ComputerTool(BaseAnthropicTool):
                 window.mouseY = event.clientY;
             });
         """)
+        # watch for requests before the action can start them
+        self.settle.install(self._web_driver)
         if action in ("mouse_move"):
             return await self.mouse_move_actions(action=action, text=text, coordinate=coordinate)
             
@@ -151,17 +183,17 @@ class ComputerTool(BaseAnthropicTool):
         if not all(isinstance(i, int) and i >= 0 for i in coordinate):
             raise ToolError(f"{coordinate} must be a tuple of non-negative ints")
 
-        x, y = coordinate
+        x, y = self.scale_coordinates(ScalingSource.API, *coordinate)
         try:
             # get current mouse position
             x1, y1 = await self.get_mouse_coordinates()
             if x1 is None or y1 is None:
                 #print("Mouse position is not available.")
-                cmd = ActionChains(self._web_driver).move_by_offset(x, y).perform()
+                cmd = self._action_chains(self._web_driver).move_by_offset(x, y).perform()
             else:
                 # print(f'Moving mouse from {x1}, {y1} to {x}, {y}')
                 # Move the mouse from its current position to (0,0), then to the specified (x, y) location
-                cmd = ActionChains(self._web_driver).move_by_offset(-int(x1),-int(y1)).move_by_offset(x, y).perform()
+                cmd = self._action_chains(self._web_driver).move_by_offset(-int(x1),-int(y1)).move_by_offset(x, y).perform()
             self.mouse_coordinates = (x, y)
             return await self.execute(cmd)
         except Exception as e:
@@ -175,7 +207,7 @@ class ComputerTool(BaseAnthropicTool):
         
         if action == "key":
             cmd = self._get_active_element().send_keys(
-                KEY_MAP.get(text.lower(), text)
+                get_key_map().get(text.lower(), text)
             )
             return await self.execute(cmd)
         elif action == "type":
@@ -190,7 +222,8 @@ class ComputerTool(BaseAnthropicTool):
         if action == "screenshot":
             return await self._take_delayed_screenshot()
         elif action == "cursor_position":
-            x, y = (
+            x, y = self.scale_coordinates(
+                ScalingSource.COMPUTER,
                 int(self._web_driver.execute_script("return window.mouseX;")),
                 int(self._web_driver.execute_script("return window.mouseY;")),
             )
@@ -206,16 +239,19 @@ class ComputerTool(BaseAnthropicTool):
         
     async def execute(self, command, take_screenshot=True) -> ToolResult:
         """Run the command and return the output, error, and optionally a screenshot."""
+        output = ""
         base64_image = None
+        media_type = None
         try:
             command
             if take_screenshot:
-                base64_image = (await self._take_delayed_screenshot()).base64_image
-            return ToolResult(output="", error="", base64_image=base64_image)
+                screenshot = await self._take_delayed_screenshot()
+                output, base64_image, media_type = screenshot.output, screenshot.base64_image, screenshot.media_type
+            return ToolResult(output=output, error="", base64_image=base64_image, media_type=media_type)
         except ToolError as e:
-            return ToolResult(output="", error=str(e), base64_image=base64_image)
+            return ToolResult(output="", error=str(e), base64_image=base64_image, media_type=media_type)
         except Exception as e:
-            return ToolResult(output="", error=str(e), base64_image=base64_image)
+            return ToolResult(output="", error=str(e), base64_image=base64_image, media_type=media_type)
     
     async def left_click(self, coordinate: tuple[int, int]) -> ToolResult:
         """Perform a left-click at the specified coordinates."""
@@ -230,28 +266,66 @@ class ComputerTool(BaseAnthropicTool):
             return ToolResult(error=str(e))
     
     async def _take_delayed_screenshot(self):
-        """Helper method to take a screenshot after a delay."""
+        """Helper method to take a screenshot once the page has settled."""
         try:
-            await asyncio.sleep(self._screenshot_delay)
+            with instrumentation.span("settle") as settle_span:
+                result = await self.settle.wait(self._web_driver)
+                settle_span.set(settled=result.settled)
             return await self.screenshot()
         except Exception as e:
-            return ToolError(f"Failed to take screenshot: {e}")
+            raise ToolError(f"Failed to take screenshot: {e}") from e
         
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-        
-        self._web_driver.save_screenshot(path)
-        #result = ToolResult(output=f"Screenshot saved at {path}", error="", base64_image=None)
-        result = ToolResult(output="", error="", base64_image=None)
+        # the driver already hands back the PNG bytes, there is no need to go to disk
+        with instrumentation.span("screenshot.capture"):
+            png = self._web_driver.get_screenshot_as_png()
+        if not png:
+            raise ToolError("Failed to take screenshot: the driver returned no image")
+        if self._archiver:
+            self._archiver.submit(f"screenshot_{uuid4().hex}.png", png)
+        with instrumentation.span("screenshot.dedup") as dedup_span:
+            duplicate = self._duplicates.is_duplicate(png)
+            dedup_span.set(duplicates=int(duplicate))
+        if duplicate:
+            # the previous image is still in the conversation, don't pay for it twice
+            return ToolResult(output=UNCHANGED_SCREEN_MESSAGE, error="")
+        output = ""
+        if self._differ:
+            with instrumentation.span("screenshot.process", png_bytes=len(png)) as process_span:
+                frame = self._pipeline.resize(png, self._image_size)
+                box = self._differ.changed_box(frame, self._web_driver.current_url)
+                if box:
+                    frame = frame.crop(box)
+                    output = CROP_MESSAGE.format(*box)
+                process_span.set(cropped=int(box is not None))
+                image = self._pipeline.encode(frame)
+        elif not self._pipeline.is_passthrough:
+            with instrumentation.span("screenshot.process", png_bytes=len(png)):
+                image = self._pipeline.process(png, self._image_size)
+        else:
+            image = png
+        with instrumentation.span("screenshot.encode", image_bytes=len(image)):
+            base64_image = base64.b64encode(image).decode()
+        return ToolResult(
+            output=output,
+            error="",
+            base64_image=base64_image,
+            media_type=self._pipeline.media_type,
+        )
 
-        if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
-        raise ToolError(f"Failed to take screenshot: {result.error}")
+    def scale_coordinates(self, source: ScalingSource, x: int, y: int) -> tuple[int, int]:
+        """Convert coordinates between the screenshots the model sees and the browser viewport."""
+        width, height = self._image_size
+        if (width, height) == (self.width, self.height):
+            return x, y
+        x_factor = self.width / width
+        y_factor = self.height / height
+        if source == ScalingSource.API:
+            if x > width or y > height:
+                raise ToolError(f"Coordinates {x}, {y} are out of bounds")
+            return round(x * x_factor), round(y * y_factor)
+        return round(x / x_factor), round(y / y_factor)
     
     async def get_mouse_coordinates(self):
         """Get the current mouse coordinates."""
@@ -263,11 +337,3 @@ class ComputerTool(BaseAnthropicTool):
     
     def _get_active_element(self):
         return self._web_driver.switch_to.active_element
-
-    def _cleanup_screenshot_dir(self):
-        """Delete all files in the screenshot directory."""
-        output_dir = Path(OUTPUT_DIR)
-        if output_dir.exists():
-            for file in output_dir.iterdir():
-                file.unlink()
-        print("Screenshot directory cleaned up")
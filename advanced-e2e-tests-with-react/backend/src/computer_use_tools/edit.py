@@ -14,14 +14,24 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from collections import defaultdict
+import codecs
+import locale
+import mmap
+import os
+import re
+import shutil
+import tempfile
+from array import array
+from collections import OrderedDict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Literal, get_args
+from typing import Any, Literal, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
-from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .base import WORKSPACE_KEY, BaseAnthropicTool, CLIResult, ToolError, ToolResult
+from .run import MAX_RESPONSE_LEN, TRUNCATED_MESSAGE, maybe_truncate
 
 Command = Literal[
     "view",
@@ -29,8 +39,211 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "batch_edit",
 ]
 SNIPPET_LINES: int = 4
+# levels of a directory listed by view
+DIRECTORY_VIEW_DEPTH: int = 2
+# undo steps kept per file, and characters of history kept across all files
+MAX_HISTORY_DEPTH: int = 50
+MAX_HISTORY_SIZE: int = 32 * 1024 * 1024
+# files from this size on are viewed through a line index instead of being read whole
+LARGE_FILE_SIZE: int = 4 * 1024 * 1024
+# bytes counted per read while counting the lines of a large file
+LINE_COUNT_CHUNK: int = 16 * 1024 * 1024
+# the line endings read_text translates to "\n"
+LINE_BREAK = re.compile(rb"\r\n|\r|\n")
+# bytes of a large file read for one view: enough for MAX_RESPONSE_LEN characters and the clipped notice
+MAX_VIEW_BYTES: int = 4 * MAX_RESPONSE_LEN + 4
+
+
+def _walk_directory(
+    path: str, depth: int, scanned: list[tuple[str, int]], errors: list[str]
+) -> Iterator[str]:
+    """
+    Yield the paths below `path` the way `find path -maxdepth depth -not -path '*/.*'`
+    prints them, skipping hidden items. Every directory read is added to `scanned`
+    with its modification time, and every one that could not be read to `errors`.
+    """
+    try:
+        entries = os.scandir(path)
+        scanned.append((path, os.stat(path).st_mtime_ns))
+    except OSError as e:
+        errors.append(f"find: '{path}': {e.strerror}")
+        return
+    with entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            yield entry.path
+            if depth > 1 and entry.is_dir(follow_symlinks=False):
+                yield from _walk_directory(entry.path, depth - 1, scanned, errors)
+
+
+def _common_prefix_length(a: str, b: str, limit: int) -> int:
+    """Length of the common prefix of a and b, found by bisecting on slice comparisons."""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _common_suffix_length(a: str, b: str, limit: int) -> int:
+    """Length of the common suffix of a and b, at most `limit`."""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[len(a) - middle :] == b[len(b) - middle :]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+@dataclass(frozen=True)
+class _ReverseDiff:
+    """Turns a version back into the one before it: keep `prefix` and `suffix` characters, put `text` between."""
+
+    prefix: int
+    suffix: int
+    text: str
+
+    @classmethod
+    def between(cls, newer: str, older: str) -> "_ReverseDiff":
+        prefix = _common_prefix_length(newer, older, min(len(newer), len(older)))
+        suffix = _common_suffix_length(
+            newer, older, min(len(newer), len(older)) - prefix
+        )
+        return cls(prefix, suffix, older[prefix : len(older) - suffix])
+
+    def apply(self, newer: str) -> str:
+        return newer[: self.prefix] + self.text + newer[len(newer) - self.suffix :]
+
+
+@dataclass
+class _UndoStack:
+    top: str
+    diffs: list[_ReverseDiff] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return len(self.top) + sum(len(diff.text) for diff in self.diffs)
+
+
+class _LineIndex:
+    """
+    The line count and line start offsets of a large file, valid while its
+    modification time and size are unchanged. Offsets are only filled in as far as
+    a view has needed them; the file is memory-mapped for the duration of each read.
+    Lines end the way read_text sees them, at "\r\n", "\r" or "\n", and a file
+    read_text could not decode is rejected the same way.
+    """
+
+    def __init__(self, path: Path):
+        stat = path.stat()
+        self.key = (stat.st_mtime_ns, stat.st_size)
+        self._starts = array("q", [0])
+        decoder = _text_decoder()
+        line_breaks = 0
+        with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, len(data), LINE_COUNT_CHUNK):
+                chunk = data[start : start + LINE_COUNT_CHUNK]
+                decoder.decode(chunk)
+                line_breaks += chunk.count(b"\n") + chunk.count(b"\r") - chunk.count(b"\r\n")
+                # a "\r\n" split between two chunks is one line break, not two
+                if start and chunk[:1] == b"\n" and data[start - 1 : start] == b"\r":
+                    line_breaks -= 1
+            decoder.decode(b"", final=True)
+        self.line_count = line_breaks + 1
+
+    def read_lines(self, path: Path, init_line: int, final_line: int) -> str:
+        """Lines `init_line` to `final_line` (1-based, inclusive, -1 for the last line)."""
+        with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = self._line_start(data, init_line)
+            if final_line == -1 or final_line >= self.line_count:
+                end = len(data)
+            else:
+                # stop before the line break ending final_line
+                end = self._line_start(data, final_line + 1)
+                end -= 2 if data[end - 2 : end] == b"\r\n" else 1
+            # the output is clipped to MAX_RESPONSE_LEN characters anyway
+            clipped = end - start > MAX_VIEW_BYTES
+            return _decode_text(data[start : min(end, start + MAX_VIEW_BYTES)], final=not clipped)
+
+    def _line_start(self, data: mmap.mmap, line: int) -> int:
+        while len(self._starts) < line:
+            self._starts.append(LINE_BREAK.search(data, self._starts[-1]).end())
+        return self._starts[line - 1]
+
+
+def _text_decoder() -> codecs.IncrementalDecoder:
+    """A strict decoder for the encoding read_text uses."""
+    return codecs.getincrementaldecoder(locale.getpreferredencoding(False))()
+
+
+def _decode_text(data: bytes, final: bool) -> str:
+    """
+    Decode bytes of a file as read_text would, translating line endings to "\n".
+    Unless `final`, the bytes were cut off and an incomplete last character is dropped.
+    """
+    text = _text_decoder().decode(data, final=final)
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+class _FileHistory:
+    """
+    The undo stacks of the edited files.
+    Only the top version of a stack is kept in full, the ones below it as reverse
+    diffs, so an edit costs about the size of the change. Stacks hold at most
+    `max_depth` versions, and past `max_size` characters overall the oldest versions
+    of the least recently edited files are dropped first.
+    """
+
+    def __init__(self, max_depth: int = MAX_HISTORY_DEPTH, max_size: int = MAX_HISTORY_SIZE):
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self._stacks: OrderedDict[Path, _UndoStack] = OrderedDict()
+        self._size = 0
+
+    def push(self, path: Path, text: str):
+        """Save `text` as the version the next undo of `path` restores."""
+        stack = self._stacks.pop(path, None)
+        if stack is None:
+            stack = _UndoStack(text)
+        else:
+            self._size -= stack.size
+            stack.diffs.append(_ReverseDiff.between(text, stack.top))
+            stack.top = text
+            del stack.diffs[: max(0, len(stack.diffs) + 1 - self.max_depth)]
+        self._stacks[path] = stack
+        self._size += stack.size
+        self._evict()
+
+    def pop(self, path: Path) -> str | None:
+        """Take the latest saved version of `path`, or None if there is none."""
+        stack = self._stacks.pop(path, None)
+        if stack is None:
+            return None
+        self._size -= stack.size
+        text = stack.top
+        if stack.diffs:
+            stack.top = stack.diffs.pop().apply(text)
+            self._stacks[path] = stack
+            self._size += stack.size
+        return text
+
+    def _evict(self):
+        while self._size > self.max_size and self._stacks:
+            path, stack = next(iter(self._stacks.items()))
+            if stack.diffs:
+                self._size -= len(stack.diffs.pop(0).text)
+            else:
+                del self._stacks[path]
+                self._size -= len(stack.top)
 
 
 class EditTool(BaseAnthropicTool):
@@ -42,12 +255,22 @@ class EditTool(BaseAnthropicTool):
     api_type: Literal["text_editor_20241022"] = "text_editor_20241022"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: _FileHistory
+    _line_indexes: dict[Path, _LineIndex]
+    _listings: dict[Path, tuple[list[tuple[str, int]], CLIResult]]
 
-    def __init__(self):
-        self._file_history = defaultdict(list)
+    def __init__(self, cache_listings: bool = True):
+        self._file_history = _FileHistory()
+        self._line_indexes = {}
+        self._listings = {}
+        self._cache_listings = cache_listings
         super().__init__()
 
+    def concurrency_key(self, tool_input: dict[str, Any]) -> str:
+        # edits of different files are independent, but not of bash commands;
+        # resolved so that every spelling of a path, symlinks included, shares a key
+        return f"{WORKSPACE_KEY}:{Path(tool_input.get('path', '')).resolve(strict=False)}"
+
     def to_params(self) -> BetaToolTextEditor20241022Param:
         return {
             "name": self.name,
@@ -64,6 +287,7 @@ class EditTool(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict[str, Any]] | None = None,
         **kwargs,
     ):
         _path = Path(path)
@@ -74,7 +298,7 @@ class EditTool(BaseAnthropicTool):
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._file_history.push(_path, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -92,6 +316,10 @@ class EditTool(BaseAnthropicTool):
             return self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
             return self.undo_edit(_path)
+        elif command == "batch_edit":
+            if not isinstance(edits, list):
+                raise ToolError("Parameter `edits` is required for command: batch_edit")
+            return self.batch_edit(_path, edits)
         raise ToolError(
             f'Unrecognized command {command}. The allowed commands for the {self.name} tool are: {", ".join(get_args(Command))}'
         )
@@ -130,35 +358,16 @@ class EditTool(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
-            )
-            if not stderr:
-                stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
-            return CLIResult(output=stdout, error=stderr)
+            return self.view_directory(path)
+
+        if path.stat().st_size >= LARGE_FILE_SIZE:
+            return self._view_large_file(path, view_range)
 
         file_content = self.read_file(path)
         init_line = 1
         if view_range:
-            if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
-                raise ToolError(
-                    "Invalid `view_range`. It should be a list of two integers."
-                )
             file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
-            init_line, final_line = view_range
-            if init_line < 1 or init_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
-                )
-            if final_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
-                )
-            if final_line != -1 and final_line < init_line:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
-                )
+            init_line, final_line = self._check_view_range(view_range, len(file_lines))
 
             if final_line == -1:
                 file_content = "\n".join(file_lines[init_line - 1 :])
@@ -169,50 +378,98 @@ class EditTool(BaseAnthropicTool):
             output=self._make_output(file_content, str(path), init_line=init_line)
         )
 
-    def str_replace(self, path: Path, old_str: str, new_str: str | None):
-        """Implement the str_replace command, which replaces old_str with new_str in the file content"""
-        # Read the file content
-        file_content = self.read_file(path).expandtabs()
-        old_str = old_str.expandtabs()
-        new_str = new_str.expandtabs() if new_str is not None else ""
+    def view_directory(self, path: Path):
+        """List a directory up to DIRECTORY_VIEW_DEPTH levels deep, stopping at the truncation limit."""
+        if self._cache_listings and (cached := self._listings.get(path)):
+            scanned, result = cached
+            try:
+                # a listing stays valid while none of the directories it read changed
+                if all(os.stat(directory).st_mtime_ns == mtime for directory, mtime in scanned):
+                    return result
+            except OSError:
+                pass
+
+        scanned: list[tuple[str, int]] = []
+        errors: list[str] = []
+        lines = [str(path)]
+        length = len(lines[0]) + 1
+        for entry in _walk_directory(str(path), DIRECTORY_VIEW_DEPTH, scanned, errors):
+            lines.append(entry)
+            length += len(entry) + 1
+            if length > MAX_RESPONSE_LEN:
+                break
+        stdout = "\n".join(lines) + "\n"
+        if len(stdout) > MAX_RESPONSE_LEN:
+            stdout = stdout[:MAX_RESPONSE_LEN] + TRUNCATED_MESSAGE
+        stderr = "\n".join(errors)
+
+        if not stderr:
+            stdout = f"Here's the files and directories up to {DIRECTORY_VIEW_DEPTH} levels deep in {path}, excluding hidden items:\n{stdout}\n"
+        result = CLIResult(output=stdout, error=stderr)
+        if self._cache_listings:
+            self._listings[path] = (scanned, result)
+        return result
+
+    def _view_large_file(self, path: Path, view_range: list[int] | None):
+        """View a large file without reading all of it."""
+        try:
+            # building the index also checks that the whole file decodes
+            index = self._line_indexes.get(path)
+            stat = path.stat()
+            if index is None or index.key != (stat.st_mtime_ns, stat.st_size):
+                index = self._line_indexes[path] = _LineIndex(path)
+
+            if not view_range:
+                with path.open("rb") as f:
+                    head = f.read(MAX_VIEW_BYTES)
+                file_content = _decode_text(head, len(head) == stat.st_size)
+                return CLIResult(output=self._make_output(file_content, str(path)))
+
+            init_line, final_line = self._check_view_range(view_range, index.line_count)
+            file_content = index.read_lines(path, init_line, final_line)
+        except (OSError, UnicodeDecodeError) as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
-        # Check if old_str is unique in the file
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
+        return CLIResult(
+            output=self._make_output(file_content, str(path), init_line=init_line)
+        )
+
+    def _check_view_range(self, view_range: list[int], n_lines_file: int) -> tuple[int, int]:
+        """Validate `view_range` against the number of lines of the file."""
+        if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
             raise ToolError(
-                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
+                "Invalid `view_range`. It should be a list of two integers."
             )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
+        init_line, final_line = view_range
+        if init_line < 1 or init_line > n_lines_file:
             raise ToolError(
-                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
             )
+        if final_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
+            )
+        if final_line != -1 and final_line < init_line:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
+            )
+        return init_line, final_line
 
-        # Replace old_str with new_str
-        new_file_content = file_content.replace(old_str, new_str)
+    def str_replace(self, path: Path, old_str: str, new_str: str | None):
+        """Implement the str_replace command, which replaces old_str with new_str in the file content"""
+        # Read the file content
+        file_content = self.read_file(path).expandtabs()
+        new_file_content, snippet = self._replace_text(path, file_content, old_str, new_str)
 
         # Write the new content to the file
         self.write_file(path, new_file_content)
 
         # Save the content to history
-        self._file_history[path].append(file_content)
-
-        # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
-        start_line = max(0, replacement_line - SNIPPET_LINES)
-        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
-        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
+        self._file_history.push(path, file_content)
 
         # Prepare the success message
         success_msg = f"The file {path} has been edited. "
-        success_msg += self._make_output(
-            snippet, f"a snippet of {path}", start_line + 1
-        )
+        success_msg += snippet
         success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
 
         return CLIResult(output=success_msg)
@@ -220,11 +477,130 @@ class EditTool(BaseAnthropicTool):
     def insert(self, path: Path, insert_line: int, new_str: str):
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
         file_text = self.read_file(path).expandtabs()
+        new_file_text, snippet = self._insert_text(file_text, insert_line, new_str)
+
+        self.write_file(path, new_file_text)
+        self._file_history.push(path, file_text)
+
+        success_msg = f"The file {path} has been edited. "
+        success_msg += snippet
+        success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def batch_edit(self, path: Path, edits: list[dict[str, Any]]):
+        """
+        Implement the batch_edit command, which applies a list of str_replace and insert
+        edits in order against one read of the file. Either every edit applies and the
+        file is written once, as a single undo step, or the file is left untouched.
+        """
+        if not edits:
+            raise ToolError("Parameter `edits` must be a non-empty list for command: batch_edit")
+        file_text = self.read_file(path).expandtabs()
+        new_file_text = file_text
+        snippets = []
+        for number, edit in enumerate(edits, start=1):
+            try:
+                if not isinstance(edit, dict):
+                    raise ToolError("Each edit must be an object.")
+                command = edit.get("command")
+                if command == "str_replace":
+                    if edit.get("old_str") is None:
+                        raise ToolError("Parameter `old_str` is required for command: str_replace")
+                    new_file_text, snippet = self._replace_text(
+                        path, new_file_text, edit["old_str"], edit.get("new_str")
+                    )
+                elif command == "insert":
+                    if edit.get("insert_line") is None:
+                        raise ToolError("Parameter `insert_line` is required for command: insert")
+                    if edit.get("new_str") is None:
+                        raise ToolError("Parameter `new_str` is required for command: insert")
+                    new_file_text, snippet = self._insert_text(
+                        new_file_text, edit["insert_line"], edit["new_str"]
+                    )
+                else:
+                    raise ToolError(
+                        f"Unrecognized command {command}. Edits of a batch can only use str_replace and insert."
+                    )
+            except ToolError as e:
+                raise ToolError(
+                    f"No edits were performed. Edit {number} of {len(edits)} failed: {e.message}"
+                ) from None
+            snippets.append(f"Edit {number}: {snippet}")
+
+        self.write_file(path, new_file_text)
+        self._file_history.push(path, file_text)
+
+        success_msg = f"The file {path} has been edited with {len(edits)} edits, in order. "
+        success_msg += "".join(snippets)
+        success_msg += "Line numbers of each snippet are as of that edit. Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def _replace_text(
+        self, path: Path, file_content: str, old_str: str, new_str: str | None
+    ) -> tuple[str, str]:
+        """Replace the only occurrence of old_str, returning the new content and a snippet of the edit."""
+        old_str = old_str.expandtabs()
+        new_str = new_str.expandtabs() if new_str is not None else ""
+
+        # Check if old_str is unique in the file
+        offset = file_content.find(old_str)
+        if offset == -1:
+            raise ToolError(
+                f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
+            )
+        if file_content.find(old_str, offset + max(len(old_str), 1)) != -1:
+            lines = self._occurrence_lines(file_content, old_str)
+            raise ToolError(
+                f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+            )
+
+        # Replace old_str with new_str
+        new_file_content = (
+            file_content[:offset] + new_str + file_content[offset + len(old_str) :]
+        )
+
+        # Create a snippet of the edited section, from the lines around the replacement
+        replacement_line = file_content.count("\n", 0, offset)
+        begin = offset
+        for _ in range(SNIPPET_LINES + 1):
+            begin = new_file_content.rfind("\n", 0, begin)
+            if begin == -1:
+                break
+        begin += 1
+        end = offset + len(new_str) - 1
+        for _ in range(SNIPPET_LINES + 1):
+            end = new_file_content.find("\n", end + 1)
+            if end == -1:
+                end = len(new_file_content)
+                break
+        start_line = replacement_line - new_file_content.count("\n", begin, offset)
+        snippet = new_file_content[begin:end]
+
+        return new_file_content, self._make_output(
+            snippet, f"a snippet of {path}", start_line + 1
+        )
+
+    def _occurrence_lines(self, file_content: str, old_str: str) -> list[int]:
+        """The lines on which each occurrence of old_str starts, including matches spanning lines."""
+        lines = []
+        line, counted = 1, 0
+        offset = file_content.find(old_str)
+        while offset != -1:
+            # count newlines only from the previous occurrence on, a single pass overall
+            line += file_content.count("\n", counted, offset)
+            counted = offset
+            if not lines or lines[-1] != line:
+                lines.append(line)
+            offset = file_content.find(old_str, offset + max(len(old_str), 1))
+        return lines
+
+    def _insert_text(self, file_text: str, insert_line: int, new_str: str) -> tuple[str, str]:
+        """Insert new_str after line insert_line, returning the new content and a snippet of the edit."""
         new_str = new_str.expandtabs()
         file_text_lines = file_text.split("\n")
         n_lines_file = len(file_text_lines)
 
-        if insert_line < 0 or insert_line > n_lines_file:
+        if not isinstance(insert_line, int) or insert_line < 0 or insert_line > n_lines_file:
             raise ToolError(
                 f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
             )
@@ -244,24 +620,18 @@ class EditTool(BaseAnthropicTool):
         new_file_text = "\n".join(new_file_text_lines)
         snippet = "\n".join(snippet_lines)
 
-        self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
-
-        success_msg = f"The file {path} has been edited. "
-        success_msg += self._make_output(
+        return new_file_text, self._make_output(
             snippet,
             "a snippet of the edited file",
             max(1, insert_line - SNIPPET_LINES + 1),
         )
-        success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
-        return CLIResult(output=success_msg)
 
     def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        old_text = self._file_history.pop(path)
+        if old_text is None:
             raise ToolError(f"No edit history found for {path}.")
 
-        old_text = self._file_history[path].pop()
         self.write_file(path, old_text)
 
         return CLIResult(
@@ -276,10 +646,31 @@ class EditTool(BaseAnthropicTool):
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
     def write_file(self, path: Path, file: str):
-        """Write the content of a file to a given path; raise a ToolError if an error occurs."""
+        """
+        Write the content of a file to a given path; raise a ToolError if an error occurs.
+        Existing files are replaced atomically, so a failed write never leaves them half written.
+        """
+        if not path.exists():
+            try:
+                path.write_text(file)
+            except Exception as e:
+                raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+            return
+
+        # replace the file a symlink points to, not the symlink
+        target = path.resolve()
+        temp_path = None
         try:
-            path.write_text(file)
+            fd, temp_path = tempfile.mkstemp(
+                dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+            )
+            with os.fdopen(fd, "w") as f:
+                f.write(file)
+            shutil.copymode(target, temp_path)
+            os.replace(temp_path, target)
         except Exception as e:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
     def _make_output(
@@ -18,6 +18,7 @@ import asyncio
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
+READ_SIZE: int = 64 * 1024  # bytes
 
 
 def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
@@ -29,23 +30,65 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
     )
 
 
+async def _capture(
+    stream: asyncio.StreamReader,
+    truncate_after: int | None,
+    keep_tail: int,
+) -> str:
+    """
+    Read a stream to the end, keeping at most `truncate_after` bytes of its head and
+    `keep_tail` bytes of its tail, so memory stays bounded however much is written.
+    """
+    head = bytearray()
+    tail = bytearray()
+    clipped = False
+    while chunk := await stream.read(READ_SIZE):
+        if not truncate_after:
+            head += chunk
+            continue
+        room = truncate_after - len(head)
+        head += chunk[:room]
+        rest = chunk[room:]
+        if not rest:
+            continue
+        if keep_tail:
+            tail += rest
+            if len(tail) > keep_tail:
+                clipped = True
+                del tail[:-keep_tail]
+        else:
+            clipped = True
+
+    if clipped:
+        return head.decode(errors="replace") + TRUNCATED_MESSAGE + tail.decode(errors="replace")
+    return (head + tail).decode(errors="replace")
+
+
 async def run(
     cmd: str,
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
+    keep_tail: int = 0,
 ):
-    """Run a shell command asynchronously with a timeout."""
+    """
+    Run a shell command asynchronously with a timeout. Output is streamed, only the
+    first `truncate_after` and the last `keep_tail` bytes of each stream are kept.
+    """
     process = await asyncio.create_subprocess_shell(
         cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
     )
+    # we know these are not None because we created the process with PIPEs
+    assert process.stdout
+    assert process.stderr
 
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
-        )
+        async with asyncio.timeout(timeout):
+            stdout, stderr = await asyncio.gather(
+                _capture(process.stdout, truncate_after, keep_tail),
+                _capture(process.stderr, truncate_after, keep_tail),
+            )
+            await process.wait()
+        return process.returncode or 0, stdout, stderr
     except asyncio.TimeoutError as exc:
         try:
             process.kill()
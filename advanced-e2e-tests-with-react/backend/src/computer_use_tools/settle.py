@@ -0,0 +1,133 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+# Installs the page instrumentation unless the current document already has it
+# (a new document starts without it).
+INSTALL_SCRIPT = """
+if (!window.__pageSettle) {
+    const state = {lastMutation: performance.now(), pending: 0};
+    window.__pageSettle = state;
+    new MutationObserver(() => { state.lastMutation = performance.now(); })
+        .observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    const originalFetch = window.fetch;
+    if (originalFetch) {
+        window.fetch = function (...args) {
+            state.pending++;
+            return originalFetch.apply(this, args).finally(() => { state.pending--; });
+        };
+    }
+    const originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function (...args) {
+        state.pending++;
+        this.addEventListener("loadend", () => { state.pending--; }, {once: true});
+        return originalSend.apply(this, args);
+    };
+}
+"""
+
+# Installs the instrumentation if needed, then reports whether the page is quiet:
+# loaded, no fetch/XHR in flight, no finite animation running and no DOM mutation
+# for at least `arguments[0]` milliseconds.
+SETTLE_SCRIPT = INSTALL_SCRIPT + """
+const quietMs = arguments[0];
+const state = window.__pageSettle;
+const animating = document.getAnimations ? document.getAnimations().some(
+    (animation) => animation.playState === "running"
+        && animation.effect
+        && animation.effect.getComputedTiming().endTime !== Infinity
+) : false;
+return document.readyState === "complete"
+    && state.pending <= 0
+    && !animating
+    && performance.now() - state.lastMutation >= quietMs;
+"""
+
+
+@dataclass(frozen=True)
+class SettleResult:
+    """How long we waited for the page, and whether it settled before the timeout."""
+
+    waited: float  # seconds
+    settled: bool
+
+
+class PageSettleDetector:
+    """
+    Waits until the page stops changing, for at most `timeout` seconds, and keeps
+    a running total of the time spent waiting.
+    Requests are only seen once the document has the instrumentation, so callers
+    should `install` it before every action. A document an action navigates to
+    gets it on the first poll; requests it starts before that are only covered by
+    the load state and the quiet period.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 2.0,
+        quiet_period: float = 0.3,
+        poll_interval: float = 0.1,
+    ):
+        self.timeout = timeout
+        self.quiet_period = quiet_period
+        self.poll_interval = poll_interval
+        self.last: SettleResult | None = None
+        self.count = 0
+        self.total_waited = 0.0
+
+    @property
+    def total_saved(self) -> float:
+        """Seconds saved compared to always sleeping for the full timeout."""
+        return self.count * self.timeout - self.total_waited
+
+    def install(self, driver):
+        """Instrument the current document, so requests started by the next action are seen."""
+        from selenium.common.exceptions import WebDriverException
+
+        try:
+            driver.execute_script(INSTALL_SCRIPT)
+        except WebDriverException:
+            # the page is navigating; the next poll installs it on the new document
+            pass
+
+    async def wait(self, driver) -> SettleResult:
+        result = await self._wait(driver)
+        self.last = result
+        self.count += 1
+        self.total_waited += result.waited
+        return result
+
+    async def _wait(self, driver) -> SettleResult:
+        from selenium.common.exceptions import WebDriverException
+
+        start = time.monotonic()
+        while True:
+            try:
+                settled = driver.execute_script(
+                    SETTLE_SCRIPT, int(self.quiet_period * 1000)
+                )
+            except WebDriverException:
+                # the page is most likely navigating; treat it as still busy
+                settled = False
+            elapsed = time.monotonic() - start
+            if settled:
+                return SettleResult(waited=elapsed, settled=True)
+            if elapsed >= self.timeout:
+                return SettleResult(waited=elapsed, settled=False)
+            await asyncio.sleep(min(self.poll_interval, self.timeout - elapsed))
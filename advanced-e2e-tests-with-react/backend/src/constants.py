@@ -26,5 +26,9 @@ ROOT_DIR = Path(__file__).resolve().parent.parent  # Adjust as needed for deeper
 
 HR = "-" * 80
 
+BROWSER_NAME = "firefox"
+# tests a browser session runs before it is replaced
+DEFAULT_MAX_USES = 20
+
 SUCCESS_INDICATOR = "pass"
 FAILURE_INDICATOR = "fail"
@@ -14,37 +14,169 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.firefox.options import Options
 from webdriver_manager.firefox import GeckoDriverManager
 from src.client import get_app_base_url
 from selenium.webdriver.firefox.service import Service as FirefoxService
+from src.constants import DEFAULT_MAX_USES
+
+def create_driver():
+    """Launch a new headless Firefox session pointed at the application under test."""
+    firefox_options = Options()
+    firefox_options.add_argument("--headless")  # Headless mode
+    firefox_options.add_argument("--disable-gpu")  # Disable GPU acceleration
+    firefox_options.add_argument("--no-sandbox")
+    firefox_options.add_argument("--window-size=1280,800")
+    if os.getenv("ENVIRONMENT") == "container":
+        if os.getenv("FIREFOX_BINARY_PATH") is None:
+            raise ValueError("FIREFOX_BINARY_PATH environment variable is not set.")
+        firefox_options.binary_location = os.getenv("FIREFOX_BINARY_PATH")
+        service = FirefoxService(executable_path=GeckoDriverManager().install())
+        driver = webdriver.Firefox(service=service, options=firefox_options)
+    else:
+        driver = webdriver.Firefox(options=firefox_options)
+    driver.get(get_app_base_url())
+    return driver
+
+
+def reset_driver(driver):
+    """Clear the state left behind by a previous test and go back to the start page."""
+    base_url = get_app_base_url()
+    # storage is per origin, so it has to be cleared from a page of the app itself
+    if not driver.current_url.startswith(base_url):
+        driver.get(base_url)
+    driver.delete_all_cookies()
+    driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+    driver.get(base_url)
+
+
+def is_driver_healthy(driver):
+    """Check that the browser session still answers commands."""
+    try:
+        driver.execute_script("return document.readyState;")
+        return True
+    except WebDriverException:
+        return False
+
+
+def quit_driver(driver):
+    """Quit a browser session, ignoring errors from sessions that already died."""
+    try:
+        driver.quit()
+    except WebDriverException:
+        pass
+
+
+class WebDriverPool:
+    """
+    A fixed-size pool of warm browser sessions.
+    Sessions are reset between tests instead of being relaunched, and are replaced
+    after `max_uses` tests or as soon as they stop responding.
+    """
+
+    def __init__(self, size: int = 1, max_uses: int = DEFAULT_MAX_USES):
+        if size < 1:
+            raise ValueError("WebDriverPool size must be at least 1.")
+        self.size = size
+        self.max_uses = max_uses
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._uses: dict[int, int] = {}
+        self._replacements: set[asyncio.Task] = set()
+        self._started = False
+        self._closed = False
+
+    async def start(self):
+        """Launch every browser of the pool in parallel."""
+        if self._started:
+            return
+        self._started = True
+        await asyncio.gather(*(self._spawn() for _ in range(self.size)))
+
+    async def acquire(self):
+        """Check out a healthy browser, waiting for one to be released if none is idle."""
+        if self._closed:
+            raise RuntimeError("WebDriverPool is closed.")
+        await self.start()
+        while True:
+            driver = await self._idle.get()
+            if isinstance(driver, Exception):
+                # the replacement failed to launch; keep the slot so later acquires retry
+                self._replace()
+                raise driver
+            if await asyncio.to_thread(is_driver_healthy, driver):
+                return driver
+            self._recycle(driver)
+
+    async def release(self, driver, healthy: bool = True):
+        """Return a browser to the pool, resetting or replacing it as needed."""
+        self._uses[id(driver)] = self._uses.get(id(driver), 0) + 1
+        if self._closed:
+            await asyncio.to_thread(quit_driver, driver)
+            return
+        if not healthy or self._uses[id(driver)] >= self.max_uses:
+            self._recycle(driver)
+            return
+        try:
+            await asyncio.to_thread(reset_driver, driver)
+        except WebDriverException:
+            self._recycle(driver)
+            return
+        self._idle.put_nowait(driver)
+
+    @asynccontextmanager
+    async def session(self):
+        """Acquire a browser for the duration of the `async with` block."""
+        driver = await self.acquire()
+        healthy = True
+        try:
+            yield driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            await self.release(driver, healthy=healthy)
+
+    async def close(self):
+        """Quit every idle browser; browsers still checked out are quit on release."""
+        self._closed = True
+        for task in list(self._replacements):
+            task.cancel()
+        drivers = []
+        while not self._idle.empty():
+            driver = self._idle.get_nowait()
+            if not isinstance(driver, Exception):
+                drivers.append(driver)
+        await asyncio.gather(*(asyncio.to_thread(quit_driver, driver) for driver in drivers))
+
+    def _recycle(self, driver):
+        self._uses.pop(id(driver), None)
+        self._replace(retired=driver)
+
+    def _replace(self, retired=None):
+        """Launch a replacement in the background so the releasing test never waits on it."""
+        async def replace():
+            if retired is not None:
+                await asyncio.to_thread(quit_driver, retired)
+            await self._spawn()
+
+        task = asyncio.create_task(replace())
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    async def _spawn(self):
+        try:
+            driver = await asyncio.to_thread(create_driver)
+        except Exception as e:
+            self._idle.put_nowait(e)
+            return
+        if self._closed:
+            await asyncio.to_thread(quit_driver, driver)
+            return
+        self._uses[id(driver)] = 0
+        self._idle.put_nowait(driver)
 
-class WebDriverSingleton:
-    _driver = None
-
-    @classmethod
-    def get_driver(cls):
-        if cls._driver is None:
-            firefox_options = Options()
-            firefox_options.add_argument("--headless")  # Headless mode
-            firefox_options.add_argument("--disable-gpu")  # Disable GPU acceleration
-            firefox_options.add_argument("--no-sandbox") 
-            firefox_options.add_argument("--window-size=1280,800")
-            if os.getenv("ENVIRONMENT") == "container":
-                if os.getenv("FIREFOX_BINARY_PATH") is None:
-                    raise ValueError("FIREFOX_BINARY_PATH environment variable is not set.")
-                firefox_options.binary_location = os.getenv("FIREFOX_BINARY_PATH")
-                service = FirefoxService(executable_path=GeckoDriverManager().install())
-                cls._driver = webdriver.Firefox(service=service, options=firefox_options)
-            else:
-                cls._driver = webdriver.Firefox(options=firefox_options)
-            cls._driver.get(get_app_base_url()) 
-        return cls._driver
-
-    @classmethod
-    def quit_driver(cls):
-        if cls._driver:
-            cls._driver.quit()
-            cls._driver = None
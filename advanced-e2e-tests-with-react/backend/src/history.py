@@ -0,0 +1,170 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+from collections import deque
+
+from anthropic.types.beta import (
+    BetaContentBlockParam,
+    BetaImageBlockParam,
+    BetaMessageParam,
+    BetaToolResultBlockParam,
+    BetaUsage,
+)
+
+DEFAULT_COMPACTION_TOKEN_BUDGET = 80_000
+# assistant turns, with their tool results, kept verbatim by a compaction
+COMPACTION_KEEP_TURNS = 10
+MAX_PROGRESS_STEPS = 100
+MAX_STEP_CHARS = 200
+
+
+class ImageHistory:
+    """
+    An index of the tool_result images of a conversation, oldest first.
+    Messages are indexed once, as they are appended, so counting images is O(1)
+    and pruning only touches the blocks it removes.
+    """
+
+    def __init__(self):
+        self._images: deque[tuple[BetaToolResultBlockParam, BetaImageBlockParam]] = deque()
+        self._indexed = 0
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def sync(self, messages: list[BetaMessageParam]):
+        """Index the messages appended since the last call."""
+        if len(messages) < self._indexed:
+            # messages were removed, not only appended: index them again
+            self._images.clear()
+            self._indexed = 0
+        for message in messages[self._indexed :]:
+            if isinstance(message["content"], str):
+                continue
+            for block in message["content"]:
+                if block["type"] != "tool_result" or isinstance(block.get("content"), str):
+                    continue
+                for item in block.get("content", []):
+                    if item["type"] == "image":
+                        self._images.append((block, item))
+        self._indexed = len(messages)
+
+    def prune(self, images_to_keep: int, min_removal_threshold: int):
+        """
+        With the assumption that images are screenshots that are of diminishing value as
+        the conversation progresses, remove all but the final `images_to_keep` images in
+        place, in chunks of `min_removal_threshold` to reduce the amount we break the
+        implicit prompt cache.
+        """
+        images_to_remove = len(self._images) - images_to_keep
+        # for better cache behavior, we want to remove in chunks
+        images_to_remove -= images_to_remove % min_removal_threshold
+        for _ in range(max(images_to_remove, 0)):
+            tool_result, image = self._images.popleft()
+            content = tool_result["content"]
+            # match by identity: another screenshot may be equal to this one
+            for index, item in enumerate(content):
+                if item is image:
+                    del content[index]
+                    break
+
+
+class ConversationCompactor:
+    """
+    Keeps the request size of long tests flat: once a prompt grows past
+    `token_budget`, the oldest turns are dropped and a progress note listing what
+    they did is added to the test prompt. The last `keep_turns` assistant turns
+    are kept verbatim, and a turn is always dropped together with its tool
+    results so every tool_use keeps its tool_result.
+    """
+
+    def __init__(self, token_budget: int, keep_turns: int = COMPACTION_KEEP_TURNS):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self._prompt: BetaMessageParam | None = None
+        self._steps: list[str] = []
+        self._dropped_turns = 0
+
+    def maybe_compact(self, messages: list[BetaMessageParam], usage: BetaUsage | None) -> bool:
+        """Compact `messages` in place if the last request was over budget; return whether it did."""
+        if usage is None:
+            return False
+        prompt_tokens = (
+            usage.input_tokens
+            + (usage.cache_read_input_tokens or 0)
+            + (usage.cache_creation_input_tokens or 0)
+        )
+        if prompt_tokens <= self.token_budget:
+            return False
+        turns = [index for index, message in enumerate(messages) if message["role"] == "assistant"]
+        if len(turns) <= self.keep_turns:
+            return False
+        cut = turns[-self.keep_turns]
+        if self._prompt is None:
+            self._prompt = messages[0]
+        self._record_steps(messages[1:cut])
+        messages[:] = [self._prompt_with_note(), *messages[cut:]]
+        return True
+
+    def _record_steps(self, dropped: list[BetaMessageParam]):
+        failed = {
+            block["tool_use_id"]
+            for message in dropped
+            if message["role"] == "user" and not isinstance(message["content"], str)
+            for block in message["content"]
+            if block["type"] == "tool_result" and block.get("is_error")
+        }
+        for message in dropped:
+            if message["role"] != "assistant":
+                continue
+            self._dropped_turns += 1
+            for block in message["content"]:
+                if block["type"] == "text":
+                    self._steps.append(f"Said: {_shorten(block['text'])}")
+                elif block["type"] == "tool_use":
+                    step = f"{block['name']}: {_shorten(json.dumps(block['input']))}"
+                    self._steps.append(f"{step} (failed)" if block["id"] in failed else step)
+
+    def _prompt_with_note(self) -> BetaMessageParam:
+        content = self._prompt["content"]
+        if isinstance(content, str):
+            blocks: list[BetaContentBlockParam] = [{"type": "text", "text": content}]
+        else:
+            # the cache breakpoints are placed again by the loop
+            blocks = [
+                {key: value for key, value in block.items() if key != "cache_control"}
+                for block in content
+            ]
+        steps = self._steps[-MAX_PROGRESS_STEPS:]
+        lines = [
+            "<progress_note>",
+            f"The first {self._dropped_turns} turns of this test were removed to keep the "
+            "conversation short. What was done in them, oldest first:",
+        ]
+        if len(self._steps) > len(steps):
+            lines.append(f"- ... {len(self._steps) - len(steps)} earlier steps")
+        lines.extend(f"- {step}" for step in steps)
+        lines.append("Continue the test from the current state of the page.")
+        lines.append("</progress_note>")
+        return {"role": "user", "content": [*blocks, {"type": "text", "text": "\n".join(lines)}]}
+
+
+def _shorten(text: str) -> str:
+    text = " ".join(text.split())
+    if len(text) <= MAX_STEP_CHARS:
+        return text
+    return text[: MAX_STEP_CHARS - 3] + "..."
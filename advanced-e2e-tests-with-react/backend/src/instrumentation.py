@@ -0,0 +1,159 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+
+@dataclass
+class Span:
+    """A timed operation: a model call, a tool call, a screenshot..."""
+
+    name: str
+    start: float
+    duration: float = 0.0
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+
+class Sink(Protocol):
+    def emit(self, span: Span) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class JsonLinesSink:
+    """Appends every span to a file as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span):
+        line = json.dumps(
+            {
+                "name": span.name,
+                "start": span.start,
+                "duration": span.duration,
+                **span.attributes,
+            },
+            default=str,
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Aggregator:
+    """Keeps the count, total and max duration of every span name, and sums its numeric counters."""
+
+    def __init__(self):
+        self.stats: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span):
+        with self._lock:
+            stats = self.stats.setdefault(span.name, {"count": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["total"] += span.duration
+            stats["max"] = max(stats["max"], span.duration)
+            for key, value in span.attributes.items():
+                # bools are ints too, but summing flags is rarely what you want
+                if isinstance(value, int | float) and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+
+    def close(self):
+        pass
+
+
+class _ActiveSpan:
+    recording = True
+
+    def __init__(self, name: str, attributes: dict[str, Any]):
+        self._span = Span(name=name, start=time.time(), attributes={**(_scope.get() or {}), **attributes})
+
+    def set(self, **attributes: Any):
+        self._span.attributes.update(attributes)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self._span.attributes["error"] = exc_type.__name__
+        for sink in _sinks:
+            sink.emit(self._span)
+        return False
+
+
+class _NoopSpan:
+    recording = False
+
+    def set(self, **attributes: Any):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_sinks: list[Sink] = []
+# attributes added to every span, e.g. the name of the test running in this task
+_scope: ContextVar[dict[str, Any] | None] = ContextVar("instrumentation_scope", default=None)
+
+
+def add_sink(sink: Sink):
+    _sinks.append(sink)
+
+
+def span(name: str, **attributes: Any) -> _ActiveSpan | _NoopSpan:
+    """
+    Time the body of a `with` block. Counters known only at the end can be added
+    with `set()`; check `recording` before computing costly ones.
+    Without sinks a shared no-op span is returned, so disabled spans cost a call.
+    """
+    if not _sinks:
+        return _NOOP_SPAN
+    return _ActiveSpan(name, attributes)
+
+
+@contextmanager
+def scope(**attributes: Any) -> Iterator[None]:
+    """Add `attributes` to every span started in this task, and in tasks it creates."""
+    token = _scope.set({**(_scope.get() or {}), **attributes})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def close():
+    """Flush and detach every sink."""
+    while _sinks:
+        _sinks.pop().close()
@@ -14,18 +14,22 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
+import json
 from collections.abc import Callable
 from datetime import datetime
 from enum import StrEnum
+from functools import cache
 from typing import Any, cast
 
 from anthropic import (
-    AnthropicBedrock,
     APIError,
     APIResponseValidationError,
     APIStatusError,
+    AsyncAnthropicBedrock,
 )
 from anthropic.types.beta import (
+    BetaCacheControlEphemeralParam,
     BetaContentBlockParam,
     BetaImageBlockParam,
     BetaMessage,
@@ -34,17 +38,21 @@ from anthropic.types.beta import (
     BetaTextBlockParam,
     BetaToolResultBlockParam,
     BetaToolUseBlockParam,
+    BetaUsage,
 )
 
-from .computer_use_tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
-from .driver.manager import WebDriverSingleton
+from . import instrumentation
+from .computer_use_tools import ToolCollection, ToolResult, ToolScheduler
 from .client import get_app_base_url
-from .constants import SUCCESS_INDICATOR, FAILURE_INDICATOR
+from .constants import BROWSER_NAME, SUCCESS_INDICATOR, FAILURE_INDICATOR
+from .history import ConversationCompactor, ImageHistory
 
-APP_URL = get_app_base_url()
 COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
-driver = WebDriverSingleton.get_driver()
+# the API allows 4 cache breakpoints: tools, system prompt and the last user turns
+CACHED_USER_TURNS = 2
+
+AWS_REGION = "us-west-2"
 
 class APIProvider(StrEnum):
     BEDROCK = "bedrock"
@@ -58,73 +66,162 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
 # We encourage modifying this system prompt to ensure the model has context for the
 # environment it is running in, and to provide any additional information that may be
 # helpful for the task at hand.
-SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
-* You are parforming a frontend end to end test on {APP_URL}, the page is open. You will be utilising selenium headless environment, which uses {driver.name} driver.
+SYSTEM_PROMPT = """<SYSTEM_CAPABILITY>
+* You are parforming a frontend end to end test on {app_url}, the page is open. You will be utilising selenium headless environment, which uses {browser_name} driver.
 * You can take a screenshot of any page when needed.
 * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
-* You will be provided with a test case scenario, which includes an assertion condition at the end. After executing all the actions needed for the test, your final message should ONLY be 1 word either '{SUCCESS_INDICATOR.title()}' or '{FAILURE_INDICATOR.title()}' to indicate whether the assertion was met.
+* To make several edits to one file, call str_replace_editor once with command `batch_edit` and an `edits` list, each edit an object with its own `command` (`str_replace` or `insert`) and parameters. The edits are applied in order and written together, or not at all if one fails; `undo_edit` reverts the whole batch.
+* You will be provided with a test case scenario, which includes an assertion condition at the end. After executing all the actions needed for the test, your final message should ONLY be 1 word either '{success}' or '{failure}' to indicate whether the assertion was met.
 * Let me know if you cannot perform an action.
-* The current date is {datetime.today().strftime('%A, %B %-d, %Y')}.
+* The current date is {today}.
 </SYSTEM_CAPABILITY>
 """
 
+_client: AsyncAnthropicBedrock | None = None
+
+
+@cache
+def get_system_prompt() -> str:
+    """
+    Fill in the system prompt on first use, so importing the loop does not need
+    APP_BASE_URL to be set.
+    """
+    return SYSTEM_PROMPT.format(
+        app_url=get_app_base_url(),
+        browser_name=BROWSER_NAME,
+        success=SUCCESS_INDICATOR.title(),
+        failure=FAILURE_INDICATOR.title(),
+        today=datetime.today().strftime('%A, %B %-d, %Y'),
+    )
+
+
+def get_client() -> AsyncAnthropicBedrock:
+    """
+    Return the Bedrock client shared by every test, creating it on first use.
+    Sharing one client keeps its HTTP connection pool warm across turns and tests.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncAnthropicBedrock(aws_region=AWS_REGION)
+    return _client
+
+
 async def sampling_loop(
     *,
     system_prompt_suffix: str,
     messages: list[BetaMessageParam],
+    tool_collection: ToolCollection,
     output_callback: Callable[[BetaContentBlockParam], None],
     tool_output_callback: Callable[[ToolResult, str], None],
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    enable_prompt_caching: bool = True,
+    usage_callback: Callable[[BetaUsage], None] | None = None,
+    stream: bool = False,
+    turn_callback: Callable[[list[BetaContentBlockParam], list[ToolResult]], None]
+    | None = None,
+    compaction_token_budget: int | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+    The caller owns `tool_collection`, so concurrent tests never share a browser.
+    With `stream`, tools start running while the model is still generating.
+    `turn_callback` receives every assistant turn with the results of its tools.
+    Past `compaction_token_budget` prompt tokens, old turns are replaced by a
+    progress note, compacting `messages` in place.
     """
-    tool_collection = ToolCollection(
-        ComputerTool(),
-        BashTool(),
-        EditTool(),
-    )
     system = BetaTextBlockParam(
         type="text",
-        text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
+        text=f"{get_system_prompt()}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
+    )
+    tools = tool_collection.to_params()
+    anthropic_beta = [COMPUTER_USE_BETA_FLAG]
+    image_truncation_threshold = 10
+
+    if enable_prompt_caching:
+        anthropic_beta.append(PROMPT_CACHING_BETA_FLAG)
+        # every image removal rewrites the cached prefix from the first removed
+        # image onwards, so prune in chunks as large as the images kept: the
+        # conversation never holds more than twice the limit
+        image_truncation_threshold = only_n_most_recent_images or image_truncation_threshold
+        # the tools are the same for every test, the system prompt suffix may not be
+        tools[-1] = {**tools[-1], "cache_control": _ephemeral_cache_control()}
+        system["cache_control"] = _ephemeral_cache_control()
+
+    client = get_client()
+    images = ImageHistory()
+    compactor = (
+        ConversationCompactor(compaction_token_budget) if compaction_token_budget else None
     )
+    usage: BetaUsage | None = None
 
     while True:
-        anthropic_beta = [COMPUTER_USE_BETA_FLAG]
-        image_truncation_threshold = 10
-        #client = boto3.client('bedrock-runtime')
-        client = AnthropicBedrock(aws_region='us-west-2')
+        if compactor and compactor.maybe_compact(messages, usage):
+            # the kept turns are indexed again from scratch
+            images = ImageHistory()
 
         if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
+            images.sync(messages)
+            images.prune(
                 only_n_most_recent_images,
                 min_removal_threshold=image_truncation_threshold,
             )
 
+        if enable_prompt_caching:
+            _inject_prompt_caching(messages)
+
+        request = dict(
+            max_tokens=max_tokens,
+            messages=messages,
+            model=PROVIDER_TO_DEFAULT_MODEL_NAME[APIProvider.BEDROCK],
+            system=[system],
+            tools=tools,
+            betas=anthropic_beta,
+        )
+        tool_tasks: dict[str, asyncio.Task[ToolResult]] = {}
+        scheduler = ToolScheduler(tool_collection)
+
         # Call the API
         # we use raw_response to provide debug information to streamlit. Your
         # implementation may be able call the SDK directly with:
         # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=PROVIDER_TO_DEFAULT_MODEL_NAME[APIProvider.BEDROCK],
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=anthropic_beta,
+        with instrumentation.span("model_call", stream=stream) as model_span:
+            if model_span.recording:
+                model_span.set(**_payload_counters(messages))
+            try:
+                if stream:
+                    response = await _stream_and_dispatch(
+                        client, request, scheduler, output_callback, tool_tasks
+                    )
+                else:
+                    # awaiting the call lets other tests run their tools while this one
+                    # waits on the model
+                    raw_response = await client.beta.messages.with_raw_response.create(
+                        **request
+                    )
+                    response = raw_response.parse()
+            except (APIStatusError, APIResponseValidationError) as e:
+                _cancel_tool_tasks(tool_tasks)
+                model_span.set(error=type(e).__name__)
+                print(f"API error: {e}")
+                return messages
+            except APIError as e:
+                _cancel_tool_tasks(tool_tasks)
+                model_span.set(error=type(e).__name__)
+                print(f"API error: {e}")
+                return messages
+            model_span.set(
+                input_tokens=response.usage.input_tokens,
+                output_tokens=response.usage.output_tokens,
+                cache_read_input_tokens=response.usage.cache_read_input_tokens or 0,
+                cache_creation_input_tokens=response.usage.cache_creation_input_tokens
+                or 0,
             )
-        except (APIStatusError, APIResponseValidationError) as e:
-            print(f"API error: {e}")
-            return messages
-        except APIError as e:
-            print(f"API error: {e}")
-            return messages
 
-        response = raw_response.parse()
+        usage = response.usage
+        if usage_callback:
+            usage_callback(usage)
         response_params = _response_to_params(response)
         messages.append(
             {
@@ -133,18 +230,34 @@ async def sampling_loop(
             }
         )
 
-        tool_result_content: list[BetaToolResultBlockParam] = []
+        # start every call of the turn up front, independent ones run side by side
         for content_block in response_params:
-            output_callback(content_block)
-            if content_block["type"] == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block["name"],
-                    tool_input=cast(dict[str, Any], content_block["input"]),
-                )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
+            if content_block["type"] == "tool_use" and content_block["id"] not in tool_tasks:
+                tool_tasks[content_block["id"]] = scheduler.submit(
+                    content_block["name"], cast(dict[str, Any], content_block["input"])
                 )
-                tool_output_callback(result, content_block["id"])
+
+        tool_result_content: list[BetaToolResultBlockParam] = []
+        tool_results: list[ToolResult] = []
+        try:
+            for content_block in response_params:
+                if not stream:
+                    # streamed blocks were rendered as soon as they completed
+                    output_callback(content_block)
+                if content_block["type"] == "tool_use":
+                    # results are collected in block order, whatever order they finish in
+                    result = await tool_tasks[content_block["id"]]
+                    tool_results.append(result)
+                    tool_result_content.append(
+                        _make_api_tool_result(result, content_block["id"])
+                    )
+                    tool_output_callback(result, content_block["id"])
+        except BaseException:
+            _cancel_tool_tasks(tool_tasks)
+            raise
+
+        if turn_callback:
+            turn_callback(response_params, tool_results)
 
         if not tool_result_content:
             return messages
@@ -152,53 +265,84 @@ async def sampling_loop(
         messages.append({"content": tool_result_content, "role": "user"})
 
 
-def _maybe_filter_to_n_most_recent_images(
-    messages: list[BetaMessageParam],
-    images_to_keep: int,
-    min_removal_threshold: int,
-):
+async def _stream_and_dispatch(
+    client: AsyncAnthropicBedrock,
+    request: dict[str, Any],
+    scheduler: ToolScheduler,
+    output_callback: Callable[[BetaContentBlockParam], None],
+    tool_tasks: dict[str, asyncio.Task[ToolResult]],
+) -> BetaMessage:
     """
-    With the assumption that images are screenshots that are of diminishing value as
-    the conversation progresses, remove all but the final `images_to_keep` tool_result
-    images in place, with a chunk of min_removal_threshold to reduce the amount we
-    break the implicit prompt cache.
+    Stream a response and submit every tool_use block to `scheduler` as soon as
+    its input is complete, while the model may still be generating the following
+    blocks. The started tasks are added to `tool_tasks`, keyed by tool_use id.
     """
-    if images_to_keep is None:
-        return messages
-
-    tool_result_blocks = cast(
-        list[BetaToolResultBlockParam],
-        [
-            item
-            for message in messages
-            for item in (
-                message["content"] if isinstance(message["content"], list) else []
+    async with client.beta.messages.stream(**request) as response_stream:
+        async for event in response_stream:
+            if event.type != "content_block_stop":
+                continue
+            block = response_stream.current_message_snapshot.content[event.index]
+            if isinstance(block, BetaTextBlock):
+                output_callback({"type": "text", "text": block.text})
+                continue
+            tool_use = BetaToolUseBlockParam(
+                type="tool_use", id=block.id, name=block.name, input=block.input
             )
-            if isinstance(item, dict) and item.get("type") == "tool_result"
-        ],
-    )
+            output_callback(tool_use)
+            tool_tasks[block.id] = scheduler.submit(
+                block.name, cast(dict[str, Any], block.input)
+            )
+        return await response_stream.get_final_message()
+
+
+def _cancel_tool_tasks(tool_tasks: dict[str, asyncio.Task[ToolResult]]):
+    for task in tool_tasks.values():
+        task.cancel()
 
-    total_images = sum(
-        1
-        for tool_result in tool_result_blocks
-        for content in tool_result.get("content", [])
-        if isinstance(content, dict) and content.get("type") == "image"
-    )
 
-    images_to_remove = total_images - images_to_keep
-    # for better cache behavior, we want to remove in chunks
-    images_to_remove -= images_to_remove % min_removal_threshold
+def _payload_counters(messages: list[BetaMessageParam]) -> dict[str, int]:
+    """Count the images of a request and measure its serialized size."""
+    images = 0
+    for message in messages:
+        if isinstance(message["content"], str):
+            continue
+        for block in message["content"]:
+            if block["type"] == "image":
+                images += 1
+            elif block["type"] == "tool_result" and not isinstance(
+                block.get("content"), str
+            ):
+                images += sum(
+                    1 for item in block.get("content", []) if item["type"] == "image"
+                )
+    return {
+        "images": images,
+        "payload_bytes": len(json.dumps(messages, default=str)),
+    }
 
-    for tool_result in tool_result_blocks:
-        if isinstance(tool_result.get("content"), list):
-            new_content = []
-            for content in tool_result.get("content", []):
-                if isinstance(content, dict) and content.get("type") == "image":
-                    if images_to_remove > 0:
-                        images_to_remove -= 1
-                        continue
-                new_content.append(content)
-            tool_result["content"] = new_content
+
+def _ephemeral_cache_control() -> BetaCacheControlEphemeralParam:
+    return {"type": "ephemeral"}
+
+
+def _inject_prompt_caching(messages: list[BetaMessageParam]):
+    """
+    Set cache breakpoints on the last CACHED_USER_TURNS user turns so the growing
+    conversation prefix is read from cache, and clear the one left behind by the
+    previous turn.
+    """
+    breakpoints_remaining = CACHED_USER_TURNS
+    for message in reversed(messages):
+        if message["role"] == "user" and isinstance(
+            content := message["content"], list
+        ):
+            if breakpoints_remaining:
+                breakpoints_remaining -= 1
+                content[-1]["cache_control"] = _ephemeral_cache_control()
+            else:
+                content[-1].pop("cache_control", None)
+                # turns before this one were cleared on earlier iterations
+                break
 
 
 def _response_to_params(
@@ -236,7 +380,7 @@ def _make_api_tool_result(
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
+                        "media_type": result.media_type or "image/png",
                         "data": result.base64_image,
                     },
                 }
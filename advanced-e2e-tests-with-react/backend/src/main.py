@@ -15,21 +15,29 @@
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+from . import instrumentation
 from .prompt_utils.main import (
     get_prompt_mode,
     interactive_prompt,
-    process_file
+    process_file,
+    setup_instrumentation
 )
-from .prompt_utils.utils import _intro
+from .prompt_utils.utils import _intro, _render_span_summary
 
 async def init():
     prompt_mode = get_prompt_mode()
     _intro()
-    if prompt_mode == "file":
-        await process_file()
-    else:
-        # use interactive mode
-        await interactive_prompt()
+    aggregator = setup_instrumentation()
+    try:
+        if prompt_mode == "file":
+            await process_file()
+        else:
+            # use interactive mode
+            await interactive_prompt()
+    finally:
+        if aggregator:
+            _render_span_summary(aggregator)
+        instrumentation.close()
 
 if __name__ == "__main__":
     asyncio.run(init())
@@ -14,22 +14,31 @@
 #  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 #  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import asyncio
 import os
 from functools import partial
 
 from dotenv import load_dotenv
-from rich.console import Console
 import yaml
 
-from ..constants import HR, SUCCESS_INDICATOR
+from .. import instrumentation
+from ..client import get_app_base_url
+from ..computer_use_tools import BashSessionPool, BashTool, ComputerTool, EditTool, ToolCollection
+from ..constants import DEFAULT_MAX_USES, HR, SUCCESS_INDICATOR
+from ..instrumentation import Aggregator, JsonLinesSink
 from ..loop import sampling_loop
+from ..replay import TraceRecorder, load_trace, replay_trace, trace_key
 from .utils import (
+    DEFAULT_CONCURRENCY,
     DEFAULT_PROMPT_MODE,
     INPUT_FILE_PATH,
     Sender,
     _render_message,
+    _render_usage,
+    _get_int_env,
     _tool_output_callback,
     format_chat_input,
+    get_console,
     load_interactive_instructions,
     session
 )
@@ -37,9 +46,6 @@ from anthropic.types.beta import (
     BetaMessageParam
 )
 
-# Initialize Console instance
-console = Console()
-
 load_dotenv()
 
 http_logs = []  
@@ -50,30 +56,76 @@ def get_prompt_mode():
         print(f"PROMPT_MODE environment variable is not set.\nUsing default value: {DEFAULT_PROMPT_MODE}")
         return DEFAULT_PROMPT_MODE
     return prompt_mode
+
+def get_concurrency():
+    return _get_int_env('CONCURRENCY', DEFAULT_CONCURRENCY)
+
+def get_driver_max_uses():
+    return _get_int_env('DRIVER_MAX_USES', DEFAULT_MAX_USES)
+
+def build_bash_pool(size=1):
+    """A pool with a warm bash session per worker; BASH_ISOLATE_CWD gives each its own directory."""
+    isolate_cwd = os.getenv('BASH_ISOLATE_CWD', 'false').lower() == 'true'
+    return BashSessionPool(size=size, isolate_cwd=isolate_cwd)
+
+def setup_instrumentation() -> Aggregator | None:
+    """Attach the span sinks enabled by SPANS_FILE and SPANS_SUMMARY, returning the aggregator if any."""
+    if spans_file := os.getenv('SPANS_FILE'):
+        instrumentation.add_sink(JsonLinesSink(spans_file))
+    if os.getenv('SPANS_SUMMARY', 'false').lower() != 'true':
+        return None
+    aggregator = Aggregator()
+    instrumentation.add_sink(aggregator)
+    return aggregator
+
+def build_tool_collection(driver, bash_pool=None):
+    return ToolCollection(
+        ComputerTool(driver),
+        BashTool(bash_pool),
+        EditTool(),
+    )
     
 async def interactive_prompt():
+    # selenium is only loaded once a browser is needed
+    from ..driver.manager import WebDriverPool
+
     load_interactive_instructions()
-    while True:
-        user_input = input("Enter test commands (or 'exit' to quit): ").strip()
-        
-        if user_input.lower() == "exit":
-            print("Exiting the client.")
-            break
-        elif user_input:
-            session["chat_input"] = format_chat_input(user_input)
-            session["messages"].append(session["chat_input"])
-            # call_api(user_input)
-            await sampling_loop(
-                system_prompt_suffix="",
-                messages=[session["chat_input"]],
-                output_callback=partial(_render_message, Sender.BOT),
-                tool_output_callback=partial(
-                    _tool_output_callback, tool_state=session["tools"]
-                ),
-                only_n_most_recent_images=session["only_n_most_recent_images"]
-            )
-        else:
-            print("Please enter some text or type 'exit' to quit.")
+    pool = WebDriverPool()
+    bash_pool = build_bash_pool()
+    try:
+        # keep the same browser for the whole session so commands can build on each other
+        async with pool.session() as driver:
+            tool_collection = build_tool_collection(driver, bash_pool)
+            try:
+                while True:
+                    user_input = input("Enter test commands (or 'exit' to quit): ").strip()
+
+                    if user_input.lower() == "exit":
+                        print("Exiting the client.")
+                        break
+                    elif user_input:
+                        session["chat_input"] = format_chat_input(user_input)
+                        session["messages"].append(session["chat_input"])
+                        # call_api(user_input)
+                        await sampling_loop(
+                            system_prompt_suffix="",
+                            messages=[session["chat_input"]],
+                            tool_collection=tool_collection,
+                            output_callback=partial(_render_message, Sender.BOT),
+                            tool_output_callback=partial(
+                                _tool_output_callback, tool_state=session["tools"]
+                            ),
+                            only_n_most_recent_images=session["only_n_most_recent_images"],
+                            usage_callback=_render_usage,
+                            stream=session["stream_responses"],
+                            compaction_token_budget=session["compaction_token_budget"],
+                        )
+                    else:
+                        print("Please enter some text or type 'exit' to quit.")
+            finally:
+                await tool_collection.tool_map["bash"].close()
+    finally:
+        await asyncio.gather(pool.close(), bash_pool.close())
 
 async def process_file():
     if not os.path.exists(INPUT_FILE_PATH):
@@ -84,23 +136,125 @@ async def process_file():
     print("File loaded successfully.")
     print(f"{HR}\nTESTS\n{HR}")
 
-    for test in tests:
-        console.print(f"Running test: '{test['name']}'", style="bold blue")
-        user_input = test["prompt"]
-        session["chat_input"] = format_chat_input(user_input)
-        session["messages"].append(session["chat_input"])
-        # call_api(user_input)
-        response_list = await sampling_loop(
+    concurrency = get_concurrency()
+    get_console().print(f"Running {len(tests)} tests with concurrency {concurrency}", style="bold blue")
+    results = await run_tests(tests, concurrency)
+
+    # report in suite order, whatever order the workers finished in
+    for test, response_list in zip(tests, results):
+        get_console().print(f"Test: '{test['name']}'", style="bold blue")
+        assert_test_response(response_list, test['expected_response'])
+        get_console().print(HR)
+
+
+async def run_tests(tests, concurrency):
+    """Run the tests on `concurrency` workers and return their conversations in suite order."""
+    if not tests:
+        return []
+    from ..driver.manager import WebDriverPool
+
+    queue = asyncio.Queue()
+    for index, test in enumerate(tests):
+        queue.put_nowait((index, test))
+
+    results: list[list[BetaMessageParam]] = [[] for _ in tests]
+    workers = min(concurrency, len(tests))
+    # one warm browser per worker; startup is paid here once instead of per test
+    pool = WebDriverPool(size=workers, max_uses=get_driver_max_uses())
+    bash_pool = build_bash_pool(size=workers)
+    try:
+        await asyncio.gather(pool.start(), bash_pool.start())
+        await asyncio.gather(*(_test_worker(queue, results, pool, bash_pool) for _ in range(workers)))
+    finally:
+        await asyncio.gather(pool.close(), bash_pool.close())
+    return results
+
+
+async def _test_worker(
+    queue: asyncio.Queue,
+    results: list[list[BetaMessageParam]],
+    pool: "WebDriverPool",
+    bash_pool: BashSessionPool,
+):
+    """Pull tests off the queue and run each one on a browser checked out from the pool."""
+    while True:
+        try:
+            index, test = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        try:
+            with instrumentation.scope(test=test['name']):
+                async with pool.session() as driver:
+                    tool_collection = build_tool_collection(driver, bash_pool)
+                    try:
+                        results[index] = await _run_test(test, tool_collection)
+                    finally:
+                        # shell state must not leak into the next test
+                        await tool_collection.tool_map["bash"].close()
+        except Exception as e:
+            get_console().print(f"Error running test '{test['name']}': {e}", style="bold red")
+
+
+async def _run_test(test, tool_collection: ToolCollection) -> list[BetaMessageParam]:
+    get_console().print(f"Running test: '{test['name']}'", style="bold blue")
+    chat_input = format_chat_input(test["prompt"])
+    session["messages"].append(chat_input)
+    messages: list[BetaMessageParam] = [chat_input]
+    output_callback = partial(_render_message, Sender.BOT)
+    # every test gets its own tool state so results never leak across tests
+    tool_output_callback = partial(_tool_output_callback, tool_state={})
+    trace_mode = session["trace_mode"]
+    recorder = TraceRecorder() if trace_mode in ("record", "replay") else None
+    key = trace_key(test["prompt"], get_app_base_url())
+    try:
+        if trace_mode == "replay" and (turns := load_trace(key)):
+            if await replay_trace(
+                turns,
+                messages=messages,
+                tool_collection=tool_collection,
+                output_callback=output_callback,
+                tool_output_callback=tool_output_callback,
+                recorder=recorder,
+            ):
+                get_console().print(f"'{test['name']}': replayed from trace", style="dim")
+                return messages
+            get_console().print(
+                f"'{test['name']}': screen no longer matches the trace, continuing with the model",
+                style="dim",
+            )
+        messages = await sampling_loop(
             system_prompt_suffix="",
-            messages=[session["chat_input"]],
-            output_callback=partial(_render_message, Sender.BOT),
-            tool_output_callback=partial(
-                _tool_output_callback, tool_state=session["tools"]
-            ),
-            only_n_most_recent_images=session["only_n_most_recent_images"]
+            messages=messages,
+            tool_collection=tool_collection,
+            output_callback=output_callback,
+            tool_output_callback=tool_output_callback,
+            only_n_most_recent_images=session["only_n_most_recent_images"],
+            usage_callback=_render_usage,
+            stream=session["stream_responses"],
+            turn_callback=recorder.record_turn if recorder else None,
+            compaction_token_budget=session["compaction_token_budget"],
         )
-        assert_test_response(response_list, test['expected_response'])
-        console.print(HR)
+        # only passing runs are worth replaying; a flaky failure must not stick
+        if recorder and is_test_passed(messages):
+            recorder.save(key)
+        return messages
+    except Exception as e:
+        get_console().print(f"Error running test '{test['name']}': {e}", style="bold red")
+        return []
+    finally:
+        _report_settle_time(test, tool_collection)
+
+
+def _report_settle_time(test, tool_collection: ToolCollection):
+    computer = tool_collection.tool_map.get(ComputerTool.name)
+    if not computer or not computer.settle.count:
+        return
+    settle = computer.settle
+    get_console().print(
+        f"'{test['name']}': waited {settle.total_waited:.1f}s for the page to settle "
+        f"over {settle.count} screenshots ({settle.total_saved:.1f}s saved)",
+        style="dim",
+    )
 
 
 def load_tests(file_path):
@@ -111,16 +265,24 @@ def load_tests(file_path):
     except Exception as e:
         raise (f"Error loading tests: {e}")
 
+def get_test_status(responses: list[BetaMessageParam]) -> str:
+    final_response = responses[-1]["content"]
+    return final_response[-1]['text'].split('\n')[-1]
+
+def is_test_passed(responses: list[BetaMessageParam]) -> bool:
+    try:
+        return SUCCESS_INDICATOR in get_test_status(responses).lower()
+    except (IndexError, KeyError, TypeError):
+        return False
+
 def assert_test_response(responses: list[BetaMessageParam], expected_response):
     try:
-        final_response = responses[-1]["content"]
-        status = final_response[-1]['text'].split('\n')[-1]
-        console.print(HR)
+        status = get_test_status(responses)
+        get_console().print(HR)
         if SUCCESS_INDICATOR in status.lower():
-            console.print("TEST PASSED", style="bold green")
+            get_console().print("TEST PASSED", style="bold green")
         else:
-            console.print("TEST FAIL", style="bold red")
-        console.print(f"Expected response: {expected_response}", style="bold blue")
+            get_console().print("TEST FAIL", style="bold red")
+        get_console().print(f"Expected response: {expected_response}", style="bold blue")
     except Exception as e:
-        console.print(f"Error asserting response: {e}", style="bold red")
-        
\ No newline at end of file
+        get_console().print(f"Error asserting response: {e}", style="bold red")
@@ -17,6 +17,7 @@
 import os
 import httpx
 import traceback
+from functools import cache
 
 from src.computer_use_tools import ToolResult
 from datetime import datetime, timedelta
@@ -24,23 +25,35 @@ from anthropic import RateLimitError
 from enum import StrEnum
 from typing import cast
 from rich.console import Console
+from rich.table import Table
 from rich.syntax import Syntax
 from rich.markdown import Markdown
 from ..constants import BASE_DIR, HR
-
-console = Console()
-
+from ..history import DEFAULT_COMPACTION_TOKEN_BUDGET
+from ..instrumentation import Aggregator
 from anthropic.types.beta import (
     BetaContentBlockParam,
+    BetaUsage,
 )
 
 CONFIG_DIR = "./client/config"
 DEFAULT_PROMPT_MODE = 'file'
+DEFAULT_CONCURRENCY = 1
 if os.getenv("ENVIRONMENT") == "container":
     INPUT_FILE_PATH = os.path.join(BASE_DIR, "..", "tests", "e2e.yml")
 else:
     INPUT_FILE_PATH = os.path.join(BASE_DIR, "..", "..", "frontend", "tests", "e2e.yml")
 
+def _get_int_env(name, default, minimum=1):
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return max(minimum, int(value))
+    except ValueError:
+        print(f"Invalid {name} value: {value}\nUsing default value: {default}")
+        return default
+
 class Sender(StrEnum):
     USER = "user"
     BOT = "assistant"
@@ -51,9 +64,20 @@ session = {
     "chat_input": "",
     "only_n_most_recent_images": 10,
     "responses": {}, "tools": {}, "write": [], "error": [],
-    "hide_images": False
+    "hide_images": False,
+    "stream_responses": os.getenv("STREAM_RESPONSES", "false").lower() == "true",
+    "trace_mode": os.getenv("TRACE_MODE", "off").lower(),
+    # 0 turns compaction off
+    "compaction_token_budget": _get_int_env(
+        "COMPACTION_TOKEN_BUDGET", DEFAULT_COMPACTION_TOKEN_BUDGET, minimum=0
+    ),
 }
 
+@cache
+def get_console() -> Console:
+    """The console shared by the client, created on first output."""
+    return Console()
+
 def format_chat_input(user_input):
     formated_input = {
         "role": "user",
@@ -84,24 +108,24 @@ def _render_message(
         if message.output:
             if message.__class__.__name__ == "CLIResult":
                 syntax = Syntax(message.output, "python", theme="monokai", line_numbers=True)
-                console.print(syntax)
+                get_console().print(syntax)
             elif message.base64_image and not session["hide_images"]:
-                console.print(message.output, style="bold blue")
+                get_console().print(message.output, style="bold blue")
             else:
-                console.print(Markdown(message.output))
+                get_console().print(Markdown(message.output))
         if message.error:
-            console.print(message.error, style="bold red")
+            get_console().print(message.error, style="bold red")
     elif isinstance(message, dict):
         if message["type"] == "text":
-            console.print(message["text"])
+            get_console().print(message["text"])
         elif message["type"] == "tool_use":
             syntax = Syntax(f'Tool Use: {message["name"]}\nInput: {message["input"]}', "python", theme="monokai", line_numbers=True)
-            console.print(syntax)
+            get_console().print(syntax)
         else:
             # only expected return types are text and tool_use
             raise Exception(f'Unexpected response type {message["type"]}')
     else:
-        console.print(Markdown(message))
+        get_console().print(Markdown(message))
 
 
 def _tool_output_callback(
@@ -112,6 +136,36 @@ def _tool_output_callback(
     _render_message(Sender.TOOL, tool_output)
 
 
+def _render_usage(usage: BetaUsage):
+    """Print the token usage of a single model turn, including prompt cache hits."""
+    get_console().print(
+        f"Tokens: input {usage.input_tokens}, output {usage.output_tokens}, "
+        f"cache read {usage.cache_read_input_tokens or 0}, "
+        f"cache write {usage.cache_creation_input_tokens or 0}",
+        style="dim",
+    )
+
+
+def _render_span_summary(aggregator: Aggregator):
+    """Print where the time of the run went, one row per span name."""
+    table = Table(title="Timings")
+    for column in ("Span", "Count", "Total (s)", "Mean (s)", "Max (s)", "Counters"):
+        table.add_column(column)
+    for name, stats in sorted(aggregator.stats.items()):
+        counters = ", ".join(
+            f"{key} {value:g}" for key, value in stats.items() if key not in ("count", "total", "max")
+        )
+        table.add_row(
+            name,
+            str(stats["count"]),
+            f"{stats['total']:.2f}",
+            f"{stats['total'] / stats['count']:.3f}",
+            f"{stats['max']:.3f}",
+            counters,
+        )
+    get_console().print(table)
+
+
 def _render_error(error: Exception):
     if isinstance(error, RateLimitError):
         body = "You have been rate limited."
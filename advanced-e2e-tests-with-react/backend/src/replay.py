@@ -0,0 +1,161 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import base64
+import gzip
+import hashlib
+import json
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, cast
+
+from anthropic.types.beta import (
+    BetaContentBlockParam,
+    BetaMessageParam,
+    BetaToolResultBlockParam,
+)
+
+from .computer_use_tools import ToolCollection, ToolResult
+from .computer_use_tools.imaging import fingerprint, fingerprint_distance
+from .loop import _make_api_tool_result
+
+TRACE_DIR = "./tests/traces"
+TRACE_VERSION = 1
+# bits of the 256-bit fingerprint allowed to differ before a screen counts as changed
+FINGERPRINT_TOLERANCE = 6
+TEXT_FINGERPRINT_PREFIX = "text:"
+
+
+class TraceRecorder:
+    """
+    Records every assistant turn of a test with a fingerprint of the result of
+    each of its tool calls: the screenshot, or the text for tools without one.
+    """
+
+    def __init__(self):
+        self.turns: list[dict[str, Any]] = []
+
+    def record_turn(
+        self, content: list[BetaContentBlockParam], results: list[ToolResult]
+    ):
+        self.turns.append(
+            {
+                # round-trip through json so later edits to the messages can't leak in
+                "content": json.loads(json.dumps(content)),
+                "fingerprints": [_result_fingerprint(result) for result in results],
+            }
+        )
+
+    def save(self, key: str):
+        path = _trace_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"version": TRACE_VERSION, "turns": self.turns}
+        path.write_bytes(gzip.compress(json.dumps(data, separators=(",", ":")).encode()))
+
+
+def trace_key(prompt: str, app_url: str) -> str:
+    """Traces are only valid for the same prompt against the same application."""
+    return hashlib.sha256(f"{app_url}\n{prompt}".encode()).hexdigest()[:16]
+
+
+def load_trace(key: str) -> list[dict[str, Any]] | None:
+    """Return the recorded turns for `key`, or None if there is no usable trace."""
+    path = _trace_path(key)
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(gzip.decompress(path.read_bytes()))
+    except (OSError, ValueError):
+        return None
+    if data.get("version") != TRACE_VERSION:
+        return None
+    return data["turns"]
+
+
+async def replay_trace(
+    turns: list[dict[str, Any]],
+    *,
+    messages: list[BetaMessageParam],
+    tool_collection: ToolCollection,
+    output_callback: Callable[[BetaContentBlockParam], None],
+    tool_output_callback: Callable[[ToolResult, str], None],
+    recorder: TraceRecorder | None = None,
+) -> bool:
+    """
+    Run the recorded tool calls directly against the browser, appending the same
+    messages the model produced when the trace was recorded.
+
+    Returns True if the whole trace replayed, in which case `messages` ends with the
+    recorded final answer. Returns False at the first tool call whose screenshot no
+    longer matches the recording; the assistant turn is cut after that call so that
+    `messages` can be handed to sampling_loop to carry on from the live screen.
+    """
+    for turn in turns:
+        content: list[BetaContentBlockParam] = []
+        fingerprints = iter(turn["fingerprints"])
+        tool_result_content: list[BetaToolResultBlockParam] = []
+        results: list[ToolResult] = []
+        diverged = False
+        for block in turn["content"]:
+            content.append(block)
+            output_callback(block)
+            if block["type"] != "tool_use":
+                continue
+            result = await tool_collection.run(
+                name=block["name"],
+                tool_input=cast(dict[str, Any], block["input"]),
+            )
+            results.append(result)
+            tool_result_content.append(_make_api_tool_result(result, block["id"]))
+            tool_output_callback(result, block["id"])
+            if not _fingerprints_match(next(fingerprints, None), result):
+                diverged = True
+                break
+
+        messages.append({"role": "assistant", "content": content})
+        if recorder:
+            recorder.record_turn(content, results)
+        if not tool_result_content:
+            # the final answer of the recorded run
+            return True
+        messages.append({"content": tool_result_content, "role": "user"})
+        if diverged:
+            return False
+    # the recording stopped before the final answer
+    return False
+
+
+def _result_fingerprint(result: ToolResult) -> str:
+    """Perceptual hash of the screenshot, or an exact hash of a text-only result."""
+    if result.base64_image:
+        return fingerprint(base64.b64decode(result.base64_image))
+    text = f"{result.output or ''}\0{result.error or ''}\0{result.system or ''}"
+    return TEXT_FINGERPRINT_PREFIX + hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _fingerprints_match(expected: str | None, result: ToolResult) -> bool:
+    actual = _result_fingerprint(result)
+    if expected is None:
+        return False
+    if expected.startswith(TEXT_FINGERPRINT_PREFIX) or actual.startswith(
+        TEXT_FINGERPRINT_PREFIX
+    ):
+        return expected == actual
+    return fingerprint_distance(expected, actual) <= FINGERPRINT_TOLERANCE
+
+
+def _trace_path(key: str) -> Path:
+    return Path(TRACE_DIR) / f"{key}.json.gz"
@@ -0,0 +1,102 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: MIT-0
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy of this
+#  software and associated documentation files (the "Software"), to deal in the Software
+#  without restriction, including without limitation the rights to use, copy, modify,
+#  merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+#  permit persons to whom the Software is furnished to do so.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+#  INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+#  PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+#  HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+#  OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+#  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+import pytest
+
+from src.history import ImageHistory
+
+IMAGES_TO_KEEP = 10
+
+
+def _screenshot_turn(index: int) -> list:
+    return [
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "tool_use", "id": f"tool_{index}", "name": "computer", "input": {}}
+            ],
+        },
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "tool_result",
+                    "tool_use_id": f"tool_{index}",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {"type": "base64", "media_type": "image/png", "data": ""},
+                        }
+                    ],
+                }
+            ],
+        },
+    ]
+
+
+def _count_images(messages: list) -> int:
+    return sum(
+        1
+        for message in messages
+        if not isinstance(message["content"], str)
+        for block in message["content"]
+        if block["type"] == "tool_result"
+        for item in block["content"]
+        if item["type"] == "image"
+    )
+
+
+@pytest.mark.parametrize("screenshots", range(1, 60))
+def test_prune_with_caching_stays_within_twice_the_limit(screenshots: int):
+    messages = [{"role": "user", "content": "Run the test"}]
+    images = ImageHistory()
+    for index in range(screenshots):
+        messages.extend(_screenshot_turn(index))
+        images.sync(messages)
+        # the chunk the loop uses when prompt caching is enabled
+        images.prune(IMAGES_TO_KEEP, min_removal_threshold=IMAGES_TO_KEEP)
+
+    assert _count_images(messages) == len(images)
+    assert min(screenshots, IMAGES_TO_KEEP) <= len(images) < 2 * IMAGES_TO_KEEP
+
+
+def test_prune_removes_the_oldest_images():
+    messages = [{"role": "user", "content": "Run the test"}]
+    for index in range(25):
+        messages.extend(_screenshot_turn(index))
+    images = ImageHistory()
+    images.sync(messages)
+
+    images.prune(IMAGES_TO_KEEP, min_removal_threshold=IMAGES_TO_KEEP)
+
+    kept = [
+        message["content"][0]["tool_use_id"]
+        for message in messages[2::2]
+        if message["content"][0]["content"]
+    ]
+    assert kept == [f"tool_{index}" for index in range(10, 25)]
+
+
+def test_sync_indexes_again_when_messages_are_removed():
+    messages = [{"role": "user", "content": "Run the test"}]
+    for index in range(5):
+        messages.extend(_screenshot_turn(index))
+    images = ImageHistory()
+    images.sync(messages)
+
+    del messages[1:7]
+    images.sync(messages)
+
+    assert len(images) == _count_images(messages) == 2
@@ -0,0 +1,287 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Offline benchmark of both sampling loops.
+
+The model is replaced by a scripted stand-in and the application under test by a
+static page served locally, so a run measures the loop, browser and tool overhead
+without calling Bedrock. Results are written as JSON.
+
+    python benchmarks/run.py --sample all --latency 0.5 --iterations 3 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import threading
+from contextlib import contextmanager, redirect_stdout
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+from unittest.mock import patch
+
+from scripted_client import ScriptedBedrock
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+APP_DIR = Path(__file__).resolve().parent / "app"
+REACT_DIR = ROOT_DIR / "advanced-e2e-tests-with-react" / "backend"
+HEADLESS_DIR = ROOT_DIR / "integrating-with-headless-browser" / "src"
+SAMPLES = ("react", "headless")
+
+TEST_CASE = "Add an item named 'benchmark' to the list and check that it is displayed."
+# Positions of the input and the button of app/index.html in a 1280x800 viewport
+NAME_INPUT = [640, 150]
+ADD_BUTTON = [640, 250]
+# The last line passes the assertion of both samples ('pass' and 'success')
+FINAL_MESSAGE = "The item 'benchmark' is displayed in the list.\nTest status: success, test passed"
+
+
+def _computer(action: str, **tool_input: Any) -> dict[str, Any]:
+    return {"type": "tool_use", "name": "computer", "input": {"action": action, **tool_input}}
+
+
+SCRIPT = [
+    [{"type": "text", "text": "Let me look at the page first."}, _computer("screenshot")],
+    [_computer("mouse_move", coordinate=NAME_INPUT)],
+    [_computer("left_click")],
+    [_computer("type", text="benchmark")],
+    [_computer("mouse_move", coordinate=ADD_BUTTON)],
+    [_computer("left_click")],
+    [_computer("screenshot")],
+    [{"type": "text", "text": FINAL_MESSAGE}],
+]
+
+
+class Timings:
+    """Collects per-step and screenshot timings by wrapping the tool classes of a sample."""
+
+    def __init__(self):
+        self.iteration = 0
+        self.steps: list[dict[str, Any]] = []
+        self.screenshots: list[dict[str, Any]] = []
+        self._captures: list[float] | None = None
+
+    @contextmanager
+    def instrument(self, collection_cls: type, computer_cls: type):
+        from selenium.webdriver.remote.webdriver import WebDriver
+
+        timings = self
+        run = collection_cls.run
+        screenshot = computer_cls.screenshot
+        get_screenshot_as_png = WebDriver.get_screenshot_as_png
+
+        async def timed_run(collection, *, name, tool_input):
+            start = perf_counter()
+            try:
+                return await run(collection, name=name, tool_input=tool_input)
+            finally:
+                timings.steps.append({
+                    "iteration": timings.iteration,
+                    "tool": name,
+                    "action": tool_input.get("action") or tool_input.get("command"),
+                    "seconds": perf_counter() - start,
+                })
+
+        async def timed_screenshot(tool, *args, **kwargs):
+            timings._captures = []
+            start = perf_counter()
+            try:
+                return await screenshot(tool, *args, **kwargs)
+            finally:
+                total = perf_counter() - start
+                capture = sum(timings._captures)
+                timings._captures = None
+                # everything screenshot() does besides asking the browser for the PNG
+                timings.screenshots.append({
+                    "iteration": timings.iteration,
+                    "capture": capture,
+                    "encode": total - capture,
+                })
+
+        def timed_get_screenshot_as_png(driver):
+            start = perf_counter()
+            try:
+                return get_screenshot_as_png(driver)
+            finally:
+                if timings._captures is not None:
+                    timings._captures.append(perf_counter() - start)
+
+        with patch.object(collection_cls, "run", timed_run), \
+                patch.object(computer_cls, "screenshot", timed_screenshot), \
+                patch.object(WebDriver, "get_screenshot_as_png", timed_get_screenshot_as_png):
+            yield self
+
+
+async def bench_react(client: ScriptedBedrock, timings: Timings, iterations: int) -> list[float]:
+    from src import loop
+    from src.computer_use_tools.collection import ToolCollection
+    from src.computer_use_tools.computer import ComputerTool
+    from src.driver.manager import WebDriverPool
+    from src.prompt_utils.main import build_tool_collection
+
+    loop._client = client
+    pool = WebDriverPool()
+    wall_times = []
+    try:
+        # launch the browser up front, the pool keeps it warm between tests
+        await pool.start()
+        with timings.instrument(ToolCollection, ComputerTool):
+            for iteration in range(iterations):
+                timings.iteration = client.iteration = iteration
+                start = perf_counter()
+                async with pool.session() as driver:
+                    await loop.sampling_loop(
+                        system_prompt_suffix="",
+                        messages=[{"role": "user", "content": TEST_CASE}],
+                        tool_collection=build_tool_collection(driver),
+                        output_callback=lambda block: None,
+                        tool_output_callback=lambda result, tool_use_id: None,
+                        only_n_most_recent_images=10,
+                    )
+                wall_times.append(perf_counter() - start)
+    finally:
+        await pool.close()
+    return wall_times
+
+
+async def bench_headless(client: ScriptedBedrock, timings: Timings, iterations: int, app_url: str) -> list[float]:
+    import agent_loop
+    from tools import ComputerTool, ToolCollection
+
+    wall_times = []
+    with patch.object(agent_loop, "AsyncAnthropicBedrock", lambda: client), \
+            timings.instrument(ToolCollection, ComputerTool):
+        for iteration in range(iterations):
+            timings.iteration = client.iteration = iteration
+            start = perf_counter()
+            # the sample launches a new browser for every test, so that is part of its time
+            await agent_loop.sampling_loop(app_url, TEST_CASE)
+            wall_times.append(perf_counter() - start)
+    return wall_times
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "total": sum(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def build_report(wall_times: list[float], client: ScriptedBedrock, timings: Timings) -> dict[str, Any]:
+    overheads = []
+    for iteration, wall_time in enumerate(wall_times):
+        calls = [call for call in client.calls if call["iteration"] == iteration]
+        steps = [step for step in timings.steps if step["iteration"] == iteration]
+        # time spent in the loop itself: neither waiting on the model nor running tools
+        overheads.append(wall_time - sum(call["seconds"] for call in calls) - sum(step["seconds"] for step in steps))
+    return {
+        "summary": {
+            "wall_time": summarize(wall_times),
+            "loop_overhead": summarize(overheads),
+            "model_call": summarize([call["seconds"] for call in client.calls]),
+            "request_bytes": summarize([call["request_bytes"] for call in client.calls]),
+            "step": summarize([step["seconds"] for step in timings.steps]),
+            "screenshot_capture": summarize([shot["capture"] for shot in timings.screenshots]),
+            "screenshot_encode": summarize([shot["encode"] for shot in timings.screenshots]),
+        },
+        "wall_times": wall_times,
+        "model_calls": client.calls,
+        "steps": timings.steps,
+        "screenshots": timings.screenshots,
+    }
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve_app():
+    """Serve the static benchmark app on a free local port."""
+    handler = partial(_QuietHandler, directory=str(APP_DIR))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", choices=(*SAMPLES, "all"), default="all")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated model latency per call, in seconds")
+    parser.add_argument("--iterations", type=int, default=3, help="test runs per sample")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    samples = SAMPLES if args.sample == "all" else (args.sample,)
+    results = {}
+
+    with serve_app() as app_url:
+        # both samples read their settings on import
+        os.environ["APP_BASE_URL"] = app_url
+        os.environ["SCREENSHOT_ARCHIVE_LIMIT"] = "0"
+        sys.path[:0] = [str(REACT_DIR), str(HEADLESS_DIR)]
+
+        for sample in samples:
+            client = ScriptedBedrock(SCRIPT, latency=args.latency)
+            timings = Timings()
+            # keep the progress output of the loops away from the JSON on stdout
+            with redirect_stdout(sys.stderr):
+                if sample == "react":
+                    wall_times = asyncio.run(bench_react(client, timings, args.iterations))
+                else:
+                    wall_times = asyncio.run(bench_headless(client, timings, args.iterations, app_url))
+            results[sample] = build_report(wall_times, client, timings)
+
+    report = {
+        "config": {
+            "latency": args.latency,
+            "iterations": args.iterations,
+            "script_turns": len(SCRIPT),
+            "python": platform.python_version(),
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
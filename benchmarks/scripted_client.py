@@ -0,0 +1,101 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import asyncio
+import json
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Any
+
+from anthropic.types.beta import BetaMessage
+
+# Rough size of a token, only used to fill in plausible usage numbers
+BYTES_PER_TOKEN = 4
+
+
+class ScriptedBedrock:
+    """
+    A local stand-in for AsyncAnthropicBedrock.
+    Every request is answered with the next assistant turn of `script`, after
+    sleeping for `latency` seconds to simulate the model. The turn is picked from
+    the number of assistant messages in the request, so one client can serve
+    many runs of the script. Calls are tagged with the current `iteration`.
+    """
+
+    def __init__(self, script: list[list[dict[str, Any]]], latency: float = 0.0):
+        self.script = script
+        self.latency = latency
+        self.iteration = 0
+        self.calls: list[dict[str, Any]] = []
+        self.beta = SimpleNamespace(messages=_ScriptedMessages(self))
+
+    async def respond(self, request: dict[str, Any]) -> BetaMessage:
+        start = perf_counter()
+        turn = sum(1 for message in request["messages"] if message["role"] == "assistant")
+        # size of the conversation the loop would upload to Bedrock
+        request_bytes = len(json.dumps(request["messages"], default=str))
+        await asyncio.sleep(self.latency)
+        response = _build_message(self.script[min(turn, len(self.script) - 1)], turn, request, request_bytes)
+        self.calls.append({
+            "iteration": self.iteration,
+            "turn": turn,
+            "seconds": perf_counter() - start,
+            "request_bytes": request_bytes,
+        })
+        return response
+
+
+class _ScriptedMessages:
+    def __init__(self, client: ScriptedBedrock):
+        self._client = client
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    async def create(self, **request: Any) -> BetaMessage:
+        return await self._client.respond(request)
+
+    async def _create_raw(self, **request: Any) -> "_RawResponse":
+        return _RawResponse(await self._client.respond(request))
+
+
+class _RawResponse:
+    def __init__(self, message: BetaMessage):
+        self._message = message
+
+    def parse(self) -> BetaMessage:
+        return self._message
+
+
+def _build_message(
+    blocks: list[dict[str, Any]], turn: int, request: dict[str, Any], request_bytes: int
+) -> BetaMessage:
+    content = [
+        {**block, "id": f"toolu_bench_{turn}_{index}"} if block["type"] == "tool_use" else block
+        for index, block in enumerate(blocks)
+    ]
+    has_tool_use = any(block["type"] == "tool_use" for block in content)
+    return BetaMessage.model_validate({
+        "id": f"msg_bench_{turn}",
+        "type": "message",
+        "role": "assistant",
+        "model": request["model"],
+        "content": content,
+        "stop_reason": "tool_use" if has_tool_use else "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": request_bytes // BYTES_PER_TOKEN,
+            "output_tokens": len(json.dumps(blocks)) // BYTES_PER_TOKEN,
+        },
+    })
@@ -14,11 +14,13 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import json
 from enum import StrEnum
-from typing import Any, cast
+from typing import Any, Optional, cast
 
-from anthropic import AnthropicBedrock
+from anthropic import AsyncAnthropicBedrock
 from anthropic.types.beta import (
+    BetaCacheControlEphemeralParam,
     BetaImageBlockParam,
     BetaMessage,
     BetaMessageParam,
@@ -26,14 +28,21 @@ from anthropic.types.beta import (
     BetaTextBlockParam,
     BetaToolResultBlockParam,
     BetaToolUseBlockParam,
+    BetaUsage,
 )
-from configs.agent import SYSTEM_PROMPT
+from configs.agent import SUCCESS_INDICATOR, SYSTEM_PROMPT
 from tools import ToolCollection, ComputerTool, ToolResult
+from utils import instrumentation
+from utils.history import ConversationCompactor
+from utils.trace import TraceRecorder, fingerprints_match, load_trace, result_fingerprint, trace_key
 
 # Beta flags
 COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
+# The API allows 4 cache breakpoints: the system prompt and the last user turns
+CACHED_USER_TURNS = 3
+
 class APIProvider(StrEnum):
     ANTHROPIC = "anthropic"
     BEDROCK = "bedrock"
@@ -52,42 +61,179 @@ async def sampling_loop(
     website_url: str,
     test_case: str,
     max_tokens: int = 4096,
+    enable_prompt_caching: bool = True,
+    trace_mode: str = "off",
+    compaction_token_budget: Optional[int] = None,
 ) -> list[BetaMessageParam]:
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+    With trace_mode 'record', passing runs are saved as traces; with 'replay', a saved
+    trace is rerun without the model until the screen stops matching it.
+    Past compaction_token_budget prompt tokens, old turns are replaced by a progress note.
     """
     messages: list[BetaMessageParam] = [{"role": "user", "content": test_case}]
     tool_collection = ToolCollection(ComputerTool(website_url))
+    recorder = TraceRecorder() if trace_mode in ("record", "replay") else None
+    key = trace_key(test_case, website_url)
+
+    if trace_mode == "replay" and (turns := load_trace(key)):
+        final_agent_message = await _replay_trace(turns, messages, tool_collection, recorder)
+        if final_agent_message is not None:
+            print("******* Replayed from trace *******\n")
+            return final_agent_message
+        print("******* Screen no longer matches the trace, continuing with the model *******\n")
+
     system_prompt = BetaTextBlockParam(type="text", text=SYSTEM_PROMPT)
-    client = AnthropicBedrock()
+    tools = tool_collection.to_params()
+    client = AsyncAnthropicBedrock()
     betas = [COMPUTER_USE_BETA_FLAG]
 
+    if enable_prompt_caching:
+        # Tools come before the system prompt, so this breakpoint caches both
+        betas.append(PROMPT_CACHING_BETA_FLAG)
+        system_prompt["cache_control"] = _ephemeral_cache_control()
+
+    compactor = ConversationCompactor(compaction_token_budget) if compaction_token_budget else None
+    usage = None
+
     while True:
-        try:
-            # Call the API and get a response
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=MODEL,
-                system=[system_prompt],
-                tools=tool_collection.to_params(),
-                betas=betas,
-            )
-        except Exception as e:
-            print(f"API call failed: {e}")
-            return messages
+        if compactor:
+            compactor.maybe_compact(messages, usage)
+
+        if enable_prompt_caching:
+            _inject_prompt_caching(messages)
 
-        response = raw_response.parse()
+        with instrumentation.span('model_call') as model_span:
+            if model_span.recording:
+                model_span.set(**_payload_counters(messages))
+            try:
+                # Call the API and get a response
+                raw_response = await client.beta.messages.with_raw_response.create(
+                    max_tokens=max_tokens,
+                    messages=messages,
+                    model=MODEL,
+                    system=[system_prompt],
+                    tools=tools,
+                    betas=betas,
+                )
+            except Exception as e:
+                model_span.set(error=type(e).__name__)
+                print(f"API call failed: {e}")
+                return messages
+
+            response = raw_response.parse()
+            model_span.set(
+                input_tokens=response.usage.input_tokens,
+                output_tokens=response.usage.output_tokens,
+                cache_read_input_tokens=response.usage.cache_read_input_tokens or 0,
+                cache_creation_input_tokens=response.usage.cache_creation_input_tokens or 0,
+            )
         print("******* New instructions received *******\n")
+        usage = response.usage
+        _print_usage(usage)
         response_params = _response_to_params(response)
         messages.append({"role": "assistant", "content": response_params})
 
         tool_result_content, final_agent_message = await _process_tool_use(tool_collection, response_params)
+        if recorder:
+            recorder.record_turn(response_params, tool_result_content)
         if not tool_result_content:
+            # Only passing runs are worth replaying; a flaky failure must not stick
+            if recorder and SUCCESS_INDICATOR in final_agent_message.split('\n')[-1].lower():
+                recorder.save(key)
             return final_agent_message
 
         messages.append({"content": tool_result_content, "role": "user"})
 
+async def _replay_trace(
+    turns: list[dict[str, Any]],
+    messages: list[BetaMessageParam],
+    tool_collection: ToolCollection,
+    recorder: Optional[TraceRecorder],
+) -> Optional[str]:
+    """
+    Run the recorded tool calls directly against the browser, appending the messages
+    the model produced when the trace was recorded.
+    Returns the recorded final message if the whole trace replayed. Returns None at the
+    first tool result that no longer matches; the assistant turn is cut after that call
+    so the model can carry on from the live screen.
+    """
+    for turn in turns:
+        content = []
+        tool_result_content = []
+        fingerprints = iter(turn["fingerprints"])
+        diverged = False
+        for block in turn["content"]:
+            content.append(block)
+            print(f'{block}\n')
+            if block["type"] != "tool_use":
+                continue
+            result = await tool_collection.run(
+                name=block["name"],
+                tool_input=cast(dict[str, Any], block["input"]),
+            )
+            tool_result = _make_api_tool_result(result, block["id"])
+            tool_result_content.append(tool_result)
+            if not fingerprints_match(next(fingerprints, None), result_fingerprint(tool_result)):
+                diverged = True
+                break
+
+        messages.append({"role": "assistant", "content": content})
+        if recorder:
+            recorder.record_turn(content, tool_result_content)
+        if not tool_result_content:
+            return content[0]['text']
+        messages.append({"content": tool_result_content, "role": "user"})
+        if diverged:
+            return None
+    # The recording stopped before the final message
+    return None
+
+def _ephemeral_cache_control() -> BetaCacheControlEphemeralParam:
+    """
+    Returns a new cache breakpoint marker.
+    """
+    return {"type": "ephemeral"}
+
+def _inject_prompt_caching(messages: list[BetaMessageParam]) -> None:
+    """
+    Move the cache breakpoints to the last CACHED_USER_TURNS user turns, so that the
+    conversation prefix sent on the previous turns is read from the cache.
+    """
+    breakpoints_remaining = CACHED_USER_TURNS
+    for message in reversed(messages):
+        if message["role"] == "user" and isinstance(content := message["content"], list):
+            if breakpoints_remaining:
+                breakpoints_remaining -= 1
+                content[-1]["cache_control"] = _ephemeral_cache_control()
+            else:
+                # Older turns were already cleared on previous iterations
+                content[-1].pop("cache_control", None)
+                break
+
+def _payload_counters(messages: list[BetaMessageParam]) -> dict[str, int]:
+    """
+    Counts the screenshots in a request and measures its serialized size.
+    """
+    images = 0
+    for message in messages:
+        if isinstance(message["content"], str):
+            continue
+        for block in message["content"]:
+            if block["type"] == "tool_result" and isinstance(block.get("content"), list):
+                images += sum(1 for item in block["content"] if item["type"] == "image")
+    return {"images": images, "payload_bytes": len(json.dumps(messages, default=str))}
+
+def _print_usage(usage: BetaUsage) -> None:
+    """
+    Print the token usage of a turn, including prompt cache reads and writes.
+    """
+    print(
+        f"Tokens: input {usage.input_tokens}, output {usage.output_tokens}, "
+        f"cache read {usage.cache_read_input_tokens or 0}, "
+        f"cache write {usage.cache_creation_input_tokens or 0}\n"
+    )
+
 async def _process_tool_use(
     tool_collection: ToolCollection,
     response_params: list[BetaTextBlockParam | BetaToolUseBlockParam],
@@ -95,16 +241,17 @@ async def _process_tool_use(
     """
     Process tool use instructions and return tool results.
     """
-    tool_result_content = []
     final_agent_message = ''
     for block in response_params:
         print(f'{block}\n')
-        if block["type"] == "tool_use":
-            result = await tool_collection.run(
-                name=block["name"],
-                tool_input=cast(dict[str, Any], block["input"]),
-            )
-            tool_result_content.append(_make_api_tool_result(result, block["id"]))
+    tool_uses = [block for block in response_params if block["type"] == "tool_use"]
+    # Browser actions stay in order, other independent calls may overlap
+    results = await tool_collection.run_many(
+        [(block["name"], cast(dict[str, Any], block["input"])) for block in tool_uses]
+    )
+    tool_result_content = [
+        _make_api_tool_result(result, block["id"]) for block, result in zip(tool_uses, results)
+    ]
 
     if not tool_result_content:
         final_agent_message = response_params[0]['text']
@@ -145,7 +292,7 @@ def _make_api_tool_result(
                 "type": "image",
                 "source": {
                     "type": "base64",
-                    "media_type": "image/png",
+                    "media_type": result.media_type or "image/png",
                     "data": result.base64_image,
                 }
             })
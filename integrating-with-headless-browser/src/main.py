@@ -15,12 +15,34 @@
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
 import asyncio
+import os
 
 from agent_loop import sampling_loop
+from configs.agent import SUCCESS_INDICATOR
+from utils import instrumentation
+from utils.history import DEFAULT_COMPACTION_TOKEN_BUDGET
+from utils.instrumentation import Aggregator, JsonLinesSink
 from utils.testcase_reader import read_test_case
 
 TEST_FILE_PATH = '../tests/testcase.txt'
-SUCCESS_INDICATOR = 'success'
+
+
+def get_compaction_token_budget() -> int:
+    """
+    Read COMPACTION_TOKEN_BUDGET, where 0 turns compaction off.
+
+    Returns:
+        The budget, or the default when the variable is unset or not a number.
+    """
+    value = os.getenv('COMPACTION_TOKEN_BUDGET')
+    if not value:
+        return DEFAULT_COMPACTION_TOKEN_BUDGET
+    try:
+        return max(0, int(value))
+    except ValueError:
+        print(f"Invalid COMPACTION_TOKEN_BUDGET value: {value}\nUsing default value: {DEFAULT_COMPACTION_TOKEN_BUDGET}")
+        return DEFAULT_COMPACTION_TOKEN_BUDGET
+
 
 # Define the main function to call the async function
 def main():
@@ -28,8 +50,26 @@ def main():
     # read test case
     test_case = read_test_case(TEST_FILE_PATH)
 
+    # Optional timings: a JSON line per span and/or a summary table at the end
+    if os.getenv('SPANS_FILE'):
+        instrumentation.add_sink(JsonLinesSink(os.getenv('SPANS_FILE')))
+    aggregator = None
+    if os.getenv('SPANS_SUMMARY', 'false').lower() == 'true':
+        aggregator = Aggregator()
+        instrumentation.add_sink(aggregator)
+
     # Run the event loop to execute the async function
-    final_agent_message = asyncio.run(sampling_loop(test_case['website'], test_case['description']))
+    try:
+        final_agent_message = asyncio.run(sampling_loop(
+            test_case['website'],
+            test_case['description'],
+            trace_mode=os.getenv('TRACE_MODE', 'off').lower(),
+            compaction_token_budget=get_compaction_token_budget(),
+        ))
+    finally:
+        if aggregator:
+            print(aggregator.report())
+        instrumentation.close()
     status = final_agent_message.split('\n')[-1] # check the readme for more info about assertion status
     if SUCCESS_INDICATOR in status.lower():
         print("\033[32mTest Passed\033[0m")
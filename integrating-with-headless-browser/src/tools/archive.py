@@ -0,0 +1,92 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import os
+import queue
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_ARCHIVE_LIMIT = 0  # archiving is off unless SCREENSHOT_ARCHIVE_LIMIT is set
+MAX_PENDING_WRITES = 32
+
+
+class ScreenshotArchiver:
+    """
+    Writes screenshots to disk on a background thread, off the agent's hot path.
+    """
+
+    def __init__(self, output_dir: str, max_files: int):
+        """
+        Starts the writer thread. The directory is emptied before the first write.
+
+        Args:
+            output_dir: Directory the screenshots are written to.
+            max_files: Number of most recent screenshots kept on disk.
+        """
+        self.output_dir = Path(output_dir)
+        self.max_files = max_files
+        self._pending: queue.Queue = queue.Queue(MAX_PENDING_WRITES)
+        self._written: deque = deque()
+        self._thread = threading.Thread(target=self._run, name="screenshot-archiver", daemon=True)
+        self._thread.start()
+
+    def submit(self, name: str, png: bytes) -> bool:
+        """
+        Queues a screenshot for writing without blocking.
+
+        Returns:
+            bool: False if the screenshot was dropped because the writer fell behind.
+        """
+        try:
+            self._pending.put_nowait((name, png))
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self) -> None:
+        """Empties the output directory, then writes queued screenshots forever."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        for file in self.output_dir.iterdir():
+            if file.is_file():
+                file.unlink(missing_ok=True)
+
+        while True:
+            name, png = self._pending.get()
+            path = self.output_dir / name
+            try:
+                path.write_bytes(png)
+            except OSError as e:
+                print(f"Failed to archive screenshot {path}: {e}")
+                continue
+            self._written.append(path)
+            # enforce the retention cap so the directory cannot grow without bound
+            while len(self._written) > self.max_files:
+                self._written.popleft().unlink(missing_ok=True)
+
+
+def create_archiver(output_dir: str) -> Optional[ScreenshotArchiver]:
+    """
+    Creates an archiver from the SCREENSHOT_ARCHIVE_LIMIT environment variable.
+
+    Returns:
+        The archiver, or None when the limit is 0 and archiving is disabled.
+    """
+    max_files = int(os.getenv("SCREENSHOT_ARCHIVE_LIMIT", DEFAULT_ARCHIVE_LIMIT))
+    if max_files <= 0:
+        return None
+    return ScreenshotArchiver(output_dir, max_files)
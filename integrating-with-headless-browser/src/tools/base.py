@@ -41,6 +41,7 @@ class ToolResult:
     output: Optional[str] = None
     error: Optional[str] = None
     base64_image: Optional[str] = None
+    media_type: Optional[str] = None
     system: Optional[str] = None
 
     def __bool__(self) -> bool:
@@ -60,6 +61,7 @@ class ToolResult:
             output=combine_fields(self.output, other.output),
             error=combine_fields(self.error, other.error),
             base64_image=combine_fields(self.base64_image, other.base64_image, False),
+            media_type=combine_fields(self.media_type, other.media_type, False),
             system=combine_fields(self.system, other.system)
         )
 
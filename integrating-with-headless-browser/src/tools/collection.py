@@ -14,10 +14,15 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from typing import Any, Dict, List
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
 from anthropic.types.beta import BetaToolUnionParam
+from utils import instrumentation
 from .base import BaseAnthropicTool, ToolError, ToolFailure, ToolResult
 
+# Tool calls of a single turn running at the same time
+DEFAULT_MAX_CONCURRENCY = 4
+
 
 class ToolCollection:
     """A collection of anthropic-defined tools for efficient management and execution."""
@@ -46,6 +51,59 @@ class ToolCollection:
         """
         return [tool.to_params() for tool in self.tools]
 
+    def concurrency_key(self, name: str, tool_input: Dict[str, Any]) -> str:
+        """
+        Calls with the same key run one after another, in order; calls with different
+        keys may overlap. Tools can define `concurrency_key(tool_input)`, by default
+        every call of a tool shares a key.
+        """
+        tool = self.tool_map.get(name)
+        if tool is not None and hasattr(tool, 'concurrency_key'):
+            return tool.concurrency_key(tool_input)
+        return name
+
+    async def run_many(
+        self, calls: List[Tuple[str, Dict[str, Any]]], max_concurrency: int = DEFAULT_MAX_CONCURRENCY
+    ) -> List[ToolResult]:
+        """
+        Executes the tool calls of a turn, overlapping the independent ones.
+
+        Args:
+            calls: The (name, tool_input) of each call, in the order Claude requested them.
+            max_concurrency: The maximum number of calls running at the same time.
+
+        Returns:
+            The results, in the order of `calls`.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+        tails: Dict[str, asyncio.Task] = {}
+        tasks = []
+        for name, tool_input in calls:
+            key = self.concurrency_key(name, tool_input)
+            task = asyncio.create_task(self._run_after(tails.get(key), semaphore, name, tool_input))
+            tails[key] = task
+            tasks.append(task)
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _run_after(
+        self,
+        previous: Optional[asyncio.Task],
+        semaphore: asyncio.Semaphore,
+        name: str,
+        tool_input: Dict[str, Any],
+    ) -> ToolResult:
+        """Runs a call once the previous call with the same key is done."""
+        if previous is not None:
+            # Wait without raising: a failed earlier call must not cancel this one
+            await asyncio.wait([previous])
+        async with semaphore:
+            return await self.run(name=name, tool_input=tool_input)
+
     async def run(self, *, name: str, tool_input: Dict[str, Any]) -> ToolResult:
         """
         Executes a tool by its name with the provided input.
@@ -61,12 +119,15 @@ class ToolCollection:
         if not tool:
             return ToolFailure(error=f"Tool '{name}' is invalid")
 
-        try:
-            # Execute the tool asynchronously
-            return await tool(**tool_input)
-        except ToolError as e:
-            # Handle known tool errors
-            return ToolFailure(error=e.message)
-        except Exception as e:
-            # Handle unexpected exceptions
-            return ToolFailure(error=f"Unexpected error: {e}")
+        with instrumentation.span('tool', tool=name, action=tool_input.get('action')) as tool_span:
+            try:
+                # Execute the tool asynchronously
+                result = await tool(**tool_input)
+            except ToolError as e:
+                # Handle known tool errors
+                result = ToolFailure(error=e.message)
+            except Exception as e:
+                # Handle unexpected exceptions
+                result = ToolFailure(error=f"Unexpected error: {e}")
+            tool_span.set(failed=bool(result.error), image=bool(result.base64_image))
+            return result
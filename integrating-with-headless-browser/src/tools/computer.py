@@ -14,20 +14,26 @@
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
 # SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-import os
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 import base64
-from pathlib import Path
 from typing import Literal, TypedDict
 from anthropic.types.beta import BetaToolComputerUse20241022Param
+from utils import instrumentation
 
+from .archive import create_archiver
 from .base import ToolResult
+from .imaging import DuplicateFilter, ImagePipeline, RegionDiffer
 
 # Constants
 OUTPUT_DIR = "../screenshots"
+UNCHANGED_SCREEN_MESSAGE = "The screen has not changed since the last screenshot."
+CROP_MESSAGE = (
+    "Only part of the screen changed. The image shows the region from ({0}, {1}) "
+    "to ({2}, {3}); the rest of the screen is as in the previous screenshots."
+)
 KEY_MAP = {
     "return": Keys.ENTER,
     "tab": Keys.TAB,
@@ -69,9 +75,14 @@ class ComputerTool:
         
         self.driver = webdriver.Chrome(options=chrome_options)
         self.width, self.height = self._get_viewport_size()
+        self.pipeline = ImagePipeline.from_env()
+        # Claude works in the coordinates of the (possibly shrunk) screenshots it is sent
+        self.image_width, self.image_height = self.pipeline.scaled_size(self.width, self.height)
+        self.duplicates = DuplicateFilter.from_env()
+        self.differ = RegionDiffer.from_env()
         self.driver.get(website_url)
         self.coordinate = (0, 0)
-        self._remove_all_files(OUTPUT_DIR)
+        self.archiver = create_archiver(OUTPUT_DIR)
 
     def _get_viewport_size(self) -> tuple[int, int]:
         """Get the actual viewport size."""
@@ -98,22 +109,56 @@ class ComputerTool:
             
             raise ValueError(f"Unsupported action: {action}")
         finally:
-            # Take a monitoring screenshot after each action
-            if not action == "screenshot":
-                await self.screenshot(action)
+            # Archive a monitoring screenshot after each action
+            if not action == "screenshot" and self.archiver:
+                self._archive(self.driver.get_screenshot_as_png(), action)
 
     async def screenshot(self, action: str = 'screenshot') -> ToolResult:
         """Take a screenshot and return it as a base64 string."""
-        path = Path(OUTPUT_DIR) / f"{self.screenshot_counter}-{action}.png"; self.screenshot_counter += 1
-        path.parent.mkdir(parents=True, exist_ok=True)
-        self.driver.save_screenshot(str(path))
-        with path.open("rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode()
-        return ToolResult(base64_image=base64_image)
+        with instrumentation.span('screenshot.capture'):
+            png = self.driver.get_screenshot_as_png()
+        if self.archiver:
+            self._archive(png, action)
+        with instrumentation.span('screenshot.dedup') as dedup_span:
+            duplicate = self.duplicates.is_duplicate(png)
+            dedup_span.set(duplicates=int(duplicate))
+        if duplicate:
+            # The previous screenshot is still in the conversation, don't pay for it twice
+            return ToolResult(output=UNCHANGED_SCREEN_MESSAGE)
+        image = png
+        output = None
+        if self.differ:
+            with instrumentation.span('screenshot.process', png_bytes=len(png)) as process_span:
+                frame = self.pipeline.resize(png, (self.image_width, self.image_height))
+                box = self.differ.changed_box(frame, self.driver.current_url)
+                if box:
+                    frame = frame.crop(box)
+                    output = CROP_MESSAGE.format(*box)
+                process_span.set(cropped=int(box is not None))
+                image = self.pipeline.encode(frame)
+        elif not self.pipeline.is_passthrough:
+            with instrumentation.span('screenshot.process', png_bytes=len(png)):
+                image = self.pipeline.process(png, (self.image_width, self.image_height))
+        with instrumentation.span('screenshot.encode', image_bytes=len(image)):
+            base64_image = base64.b64encode(image).decode()
+        return ToolResult(output=output, base64_image=base64_image, media_type=self.pipeline.media_type)
+
+    def _to_viewport(self, coordinate: tuple[int, int]) -> tuple[int, int]:
+        """Scale coordinates from the screenshot Claude sees to the browser viewport."""
+        x, y = coordinate
+        if (self.image_width, self.image_height) == (self.width, self.height):
+            return x, y
+        return round(x * self.width / self.image_width), round(y * self.height / self.image_height)
+
+    def _archive(self, png: bytes, action: str) -> None:
+        """Hand a screenshot to the background archiver."""
+        self.archiver.submit(f"{self.screenshot_counter}-{action}.png", png)
+        self.screenshot_counter += 1
 
     async def move_mouse(self, coordinate: tuple[int, int]) -> ToolResult:
         """Move the mouse to the specified coordinates."""
         try:
+            coordinate = self._to_viewport(coordinate)
             x, y = coordinate
             ActionChains(self.driver).move_by_offset(x, y).perform()
             self.coordinate = coordinate
@@ -157,8 +202,8 @@ class ComputerTool:
         return {
             "name": self.name,
             "type": self.api_type,
-            "display_height_px": self.height,
-            "display_width_px": self.width,
+            "display_height_px": self.image_height,
+            "display_width_px": self.image_width,
             "display_number": 1,
         }
 
@@ -166,10 +211,3 @@ class ComputerTool:
         """Ensure the Selenium driver is properly closed."""
         if hasattr(self, 'driver'):
             self.driver.quit()
-
-    def _remove_all_files(self, directory):
-        for filename in os.listdir(directory):
-            file_path = os.path.join(directory, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                print(f"Deleted: {file_path}")
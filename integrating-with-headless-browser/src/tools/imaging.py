@@ -0,0 +1,283 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import io
+import os
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image, ImageChops
+
+FINGERPRINT_SIZE = 16
+# Finer than FINGERPRINT_SIZE: a few typed characters must count as a change
+DEDUP_FINGERPRINT_SIZE = 64
+DEFAULT_DEDUP_DISTANCE = 0
+DEFAULT_FULL_FRAME_INTERVAL = 5
+# Past this share of the screen a crop saves too little to be worth the confusion
+MAX_CROP_AREA = 0.5
+
+# Media type sent to the model for each supported encoding
+IMAGE_FORMATS = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+COLOR_MODES = ("rgb", "grayscale", "palette")
+PALETTE_COLORS = 64
+DEFAULT_QUALITY = 80
+
+
+@dataclass(frozen=True)
+class ImagePipeline:
+    """
+    How screenshots are shrunk and re-encoded between capture and the model.
+    Smaller images mean smaller requests, faster uploads and fewer image tokens.
+    """
+    max_width: Optional[int] = None
+    color: str = "rgb"
+    image_format: str = "png"
+    quality: int = DEFAULT_QUALITY
+
+    def __post_init__(self):
+        if self.max_width is not None and self.max_width < 1:
+            raise ValueError(f"Invalid screenshot width: {self.max_width}")
+        if self.color not in COLOR_MODES:
+            raise ValueError(f"Invalid screenshot color mode: {self.color}")
+        if self.image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Invalid screenshot format: {self.image_format}")
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"Invalid screenshot quality: {self.quality}")
+
+    @classmethod
+    def from_env(cls) -> "ImagePipeline":
+        """
+        Creates a pipeline from the SCREENSHOT_MAX_WIDTH, SCREENSHOT_COLOR,
+        SCREENSHOT_FORMAT and SCREENSHOT_QUALITY environment variables.
+        """
+        max_width = os.getenv("SCREENSHOT_MAX_WIDTH")
+        return cls(
+            max_width=int(max_width) if max_width else None,
+            color=os.getenv("SCREENSHOT_COLOR", "rgb").lower(),
+            image_format=os.getenv("SCREENSHOT_FORMAT", "png").lower(),
+            quality=int(os.getenv("SCREENSHOT_QUALITY", DEFAULT_QUALITY)),
+        )
+
+    @property
+    def is_passthrough(self) -> bool:
+        """True when screenshots are sent exactly as captured."""
+        return self.max_width is None and self.color == "rgb" and self.image_format == "png"
+
+    @property
+    def media_type(self) -> str:
+        return IMAGE_FORMATS[self.image_format]
+
+    def scaled_size(self, width: int, height: int) -> Tuple[int, int]:
+        """
+        Computes the size of the images the model sees.
+
+        Args:
+            width: The viewport width.
+            height: The viewport height.
+
+        Returns:
+            The viewport size, shrunk to `max_width` with the same aspect ratio.
+        """
+        if self.max_width is None or width <= self.max_width:
+            return width, height
+        return self.max_width, round(height * self.max_width / width)
+
+    def process(self, png: bytes, size: Tuple[int, int]) -> bytes:
+        """
+        Resizes a screenshot, reduces its colors and re-encodes it.
+
+        Args:
+            png: The screenshot as captured by the browser.
+            size: The size of the image sent to the model.
+
+        Returns:
+            The encoded image, of type `media_type`.
+        """
+        if self.is_passthrough:
+            return png
+        return self.encode(self.resize(png, size))
+
+    def resize(self, png: bytes, size: Tuple[int, int]) -> Image.Image:
+        """
+        Decodes a screenshot as an RGB image.
+
+        Args:
+            png: The screenshot as captured by the browser.
+            size: The size of the image sent to Claude.
+
+        Returns:
+            The decoded image, resized to `size`.
+        """
+        with Image.open(io.BytesIO(png)) as screenshot:
+            image = screenshot.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        return image
+
+    def encode(self, image: Image.Image) -> bytes:
+        """
+        Reduces the colors of an RGB image and encodes it.
+
+        Args:
+            image: The image to encode.
+
+        Returns:
+            The encoded image, of type `media_type`.
+        """
+        if self.color == "grayscale":
+            image = image.convert("L")
+        elif self.color == "palette":
+            image = image.quantize(colors=PALETTE_COLORS)
+            if self.image_format == "jpeg":
+                # JPEG has no palette mode; the reduced colors still compress better
+                image = image.convert("RGB")
+        buffer = io.BytesIO()
+        if self.image_format == "png":
+            image.save(buffer, "PNG")
+        else:
+            image.save(buffer, self.image_format.upper(), quality=self.quality)
+        return buffer.getvalue()
+
+
+class RegionDiffer:
+    """
+    Finds the part of a screenshot that changed since the previous one, so only that
+    crop has to be sent. Every `full_frame_interval` screenshots, after a navigation,
+    or when most of the screen changed, the full frame is sent instead so Claude never
+    drifts far from the real page.
+    """
+
+    def __init__(self, full_frame_interval: int = DEFAULT_FULL_FRAME_INTERVAL):
+        self.full_frame_interval = full_frame_interval
+        self._previous: Optional[Image.Image] = None
+        self._url: Optional[str] = None
+        self._since_full_frame = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["RegionDiffer"]:
+        """
+        Creates a differ from the SCREENSHOT_DIFF and SCREENSHOT_FULL_FRAME_INTERVAL
+        environment variables.
+
+        Returns:
+            The differ, or None when diffing is off.
+        """
+        if os.getenv("SCREENSHOT_DIFF", "false").lower() != "true":
+            return None
+        interval = int(os.getenv("SCREENSHOT_FULL_FRAME_INTERVAL", DEFAULT_FULL_FRAME_INTERVAL))
+        return cls(max(1, interval))
+
+    def changed_box(self, frame: Image.Image, url: str) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Compares a screenshot with the previous one.
+
+        Args:
+            frame: The new screenshot, as sent to Claude.
+            url: The page URL; a new URL always gets a full frame.
+
+        Returns:
+            The (left, top, right, bottom) box that changed, or None when the full frame should be sent.
+        """
+        previous, self._previous = self._previous, frame
+        navigated, self._url = url != self._url, url
+        self._since_full_frame += 1
+        if (
+            previous is None
+            or navigated
+            or previous.size != frame.size
+            or self._since_full_frame >= self.full_frame_interval
+        ):
+            self._since_full_frame = 0
+            return None
+        box = ImageChops.difference(previous, frame).getbbox()
+        # Identical frames are normally caught by the DuplicateFilter first
+        if box is None or _area(box) > MAX_CROP_AREA * frame.width * frame.height:
+            self._since_full_frame = 0
+            return None
+        return box
+
+
+class DuplicateFilter:
+    """
+    Remembers the fingerprint of the last screenshot sent to Claude, to spot new
+    ones that show nothing new.
+    """
+
+    def __init__(self, max_distance: Optional[int] = DEFAULT_DEDUP_DISTANCE):
+        """
+        Args:
+            max_distance: Number of fingerprint bits allowed to differ, or None to turn the filter off.
+        """
+        self.max_distance = max_distance
+        self._last: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "DuplicateFilter":
+        """Creates a filter from SCREENSHOT_DEDUP_DISTANCE; a negative distance turns it off."""
+        max_distance = int(os.getenv("SCREENSHOT_DEDUP_DISTANCE", DEFAULT_DEDUP_DISTANCE))
+        return cls(max_distance if max_distance >= 0 else None)
+
+    def is_duplicate(self, png: bytes) -> bool:
+        """
+        Checks a new screenshot against the last one sent.
+
+        Args:
+            png: The new screenshot. It becomes the last one sent if it is not a duplicate.
+
+        Returns:
+            True if the screenshot shows nothing new.
+        """
+        if self.max_distance is None:
+            return False
+        current = fingerprint(png, DEDUP_FINGERPRINT_SIZE)
+        # Compare with the last frame sent, not the last one seen, so slow drift still shows
+        if self._last is not None and fingerprint_distance(current, self._last) <= self.max_distance:
+            return True
+        self._last = current
+        return False
+
+
+def _area(box: Tuple[int, int, int, int]) -> int:
+    left, top, right, bottom = box
+    return (right - left) * (bottom - top)
+
+
+def fingerprint(png: bytes, size: int = FINGERPRINT_SIZE) -> str:
+    """
+    Computes the difference hash of a screenshot: one bit per neighbouring pixel pair
+    of a `size` x `size` grayscale thumbnail, so small rendering noise barely moves it.
+
+    Args:
+        png: The encoded image.
+        size: The thumbnail size; the hash has size * size bits.
+
+    Returns:
+        The hash as a hex string.
+    """
+    with Image.open(io.BytesIO(png)) as image:
+        thumbnail = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = list(thumbnail.getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = bits << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def fingerprint_distance(a: str, b: str) -> int:
+    """Returns the number of differing bits between two fingerprints of the same size."""
+    return (int(a, 16) ^ int(b, 16)).bit_count()
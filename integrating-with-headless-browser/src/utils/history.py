@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+from typing import Any, Dict, List, Optional
+
+from anthropic.types.beta import BetaMessageParam, BetaUsage
+
+DEFAULT_COMPACTION_TOKEN_BUDGET = 80_000
+# Assistant turns, with their tool results, kept verbatim by a compaction
+COMPACTION_KEEP_TURNS = 10
+MAX_PROGRESS_STEPS = 100
+MAX_STEP_CHARS = 200
+
+
+class ConversationCompactor:
+    """
+    Keeps the request size of long tests flat: once a prompt grows past the token
+    budget, the oldest turns are dropped and a progress note listing what they did
+    is added to the test case message.
+    """
+
+    def __init__(self, token_budget: int, keep_turns: int = COMPACTION_KEEP_TURNS):
+        """
+        Args:
+            token_budget: Prompt tokens above which the conversation is compacted.
+            keep_turns: Number of recent assistant turns kept verbatim.
+        """
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self._prompt: Optional[BetaMessageParam] = None
+        self._steps: List[str] = []
+        self._dropped_turns = 0
+
+    def maybe_compact(self, messages: List[BetaMessageParam], usage: Optional[BetaUsage]) -> bool:
+        """
+        Compacts the conversation in place if the last request was over budget.
+        A turn is always dropped together with its tool results, so every tool_use
+        keeps its tool_result.
+
+        Args:
+            messages: The conversation, starting with the test case.
+            usage: The usage of the last response, or None before the first one.
+
+        Returns:
+            True if the conversation was compacted.
+        """
+        if usage is None:
+            return False
+        prompt_tokens = (
+            usage.input_tokens
+            + (usage.cache_read_input_tokens or 0)
+            + (usage.cache_creation_input_tokens or 0)
+        )
+        if prompt_tokens <= self.token_budget:
+            return False
+        turns = [index for index, message in enumerate(messages) if message["role"] == "assistant"]
+        if len(turns) <= self.keep_turns:
+            return False
+        cut = turns[-self.keep_turns]
+        if self._prompt is None:
+            self._prompt = messages[0]
+        self._record_steps(messages[1:cut])
+        messages[:] = [self._prompt_with_note(), *messages[cut:]]
+        return True
+
+    def _record_steps(self, dropped: List[BetaMessageParam]) -> None:
+        """Adds the text and tool calls of the dropped assistant turns to the progress note."""
+        failed = {
+            block["tool_use_id"]
+            for message in dropped
+            if message["role"] == "user" and not isinstance(message["content"], str)
+            for block in message["content"]
+            if block["type"] == "tool_result" and block.get("is_error")
+        }
+        for message in dropped:
+            if message["role"] != "assistant":
+                continue
+            self._dropped_turns += 1
+            for block in message["content"]:
+                if block["type"] == "text":
+                    self._steps.append(f"Said: {_shorten(block['text'])}")
+                elif block["type"] == "tool_use":
+                    step = f"{block['name']}: {_shorten(json.dumps(block['input']))}"
+                    self._steps.append(f"{step} (failed)" if block["id"] in failed else step)
+
+    def _prompt_with_note(self) -> BetaMessageParam:
+        """Returns the test case message followed by the progress note."""
+        content = self._prompt["content"]
+        if isinstance(content, str):
+            blocks: List[Dict[str, Any]] = [{"type": "text", "text": content}]
+        else:
+            # The cache breakpoints are placed again by the loop
+            blocks = [{key: value for key, value in block.items() if key != "cache_control"} for block in content]
+        steps = self._steps[-MAX_PROGRESS_STEPS:]
+        lines = [
+            "<progress_note>",
+            f"The first {self._dropped_turns} turns of this test were removed to keep the "
+            "conversation short. What was done in them, oldest first:",
+        ]
+        if len(self._steps) > len(steps):
+            lines.append(f"- ... {len(self._steps) - len(steps)} earlier steps")
+        lines.extend(f"- {step}" for step in steps)
+        lines.append("Continue the test from the current state of the page.")
+        lines.append("</progress_note>")
+        return {"role": "user", "content": [*blocks, {"type": "text", "text": "\n".join(lines)}]}
+
+
+def _shorten(text: str) -> str:
+    """Collapses whitespace and truncates text to MAX_STEP_CHARS."""
+    text = " ".join(text.split())
+    if len(text) <= MAX_STEP_CHARS:
+        return text
+    return text[:MAX_STEP_CHARS - 3] + "..."
@@ -0,0 +1,163 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Protocol, Union
+
+
+@dataclass
+class Span:
+    """A timed operation: a model call, a tool call, a screenshot..."""
+    name: str
+    start: float
+    duration: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class Sink(Protocol):
+    def emit(self, span: Span) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class JsonLinesSink:
+    """Appends every span to a file as one JSON object per line."""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        line = json.dumps(
+            {'name': span.name, 'start': span.start, 'duration': span.duration, **span.attributes},
+            default=str,
+        )
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Aggregator:
+    """Keeps the count, total and max duration of every span name, and sums its numeric counters."""
+
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(span.name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            stats['count'] += 1
+            stats['total'] += span.duration
+            stats['max'] = max(stats['max'], span.duration)
+            for key, value in span.attributes.items():
+                # bools are ints too, but summing flags is rarely what you want
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+
+    def close(self) -> None:
+        pass
+
+    def report(self) -> str:
+        """
+        Formats the statistics as a plain text table.
+
+        Returns:
+            One line per span name, sorted by name.
+        """
+        lines = [f"{'Span':<20} {'Count':>6} {'Total (s)':>10} {'Mean (s)':>9} {'Max (s)':>8}  Counters"]
+        for name, stats in sorted(self.stats.items()):
+            counters = ', '.join(
+                f"{key} {value:g}" for key, value in stats.items() if key not in ('count', 'total', 'max')
+            )
+            lines.append(
+                f"{name:<20} {stats['count']:>6} {stats['total']:>10.2f} "
+                f"{stats['total'] / stats['count']:>9.3f} {stats['max']:>8.3f}  {counters}"
+            )
+        return '\n'.join(lines)
+
+
+class _ActiveSpan:
+    recording = True
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        self._span = Span(name=name, start=time.time(), attributes=attributes)
+
+    def set(self, **attributes: Any) -> None:
+        self._span.attributes.update(attributes)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._span.duration = time.perf_counter() - self._started
+        if exc_type is not None:
+            self._span.attributes['error'] = exc_type.__name__
+        for sink in _sinks:
+            sink.emit(self._span)
+        return False
+
+
+class _NoopSpan:
+    recording = False
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_sinks: List[Sink] = []
+
+
+def add_sink(sink: Sink) -> None:
+    """Sends every span finished from now on to `sink`."""
+    _sinks.append(sink)
+
+
+def span(name: str, **attributes: Any) -> Union[_ActiveSpan, _NoopSpan]:
+    """
+    Times the body of a `with` block.
+
+    Args:
+        name: The span name, such as 'model_call' or 'tool'.
+        attributes: Attributes recorded with the span. Counters known only at the end
+            can be added with `set()`; check `recording` before computing costly ones.
+
+    Returns:
+        The span, or a shared no-op span when there are no sinks, so disabled spans cost a call.
+    """
+    if not _sinks:
+        return _NOOP_SPAN
+    return _ActiveSpan(name, attributes)
+
+
+def close() -> None:
+    """Flushes and detaches every sink."""
+    while _sinks:
+        _sinks.pop().close()
@@ -0,0 +1,109 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of this
+# software and associated documentation files (the "Software"), to deal in the Software
+# without restriction, including without limitation the rights to use, copy, modify,
+# merge, publish, distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR IMPLIED,
+# INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS FOR A
+# PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+# HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+# SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import base64
+import gzip
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from tools.imaging import fingerprint, fingerprint_distance
+
+TRACE_DIR = '../traces'
+TRACE_VERSION = 1
+# Bits of the 256-bit fingerprint allowed to differ before a screen counts as changed
+FINGERPRINT_TOLERANCE = 6
+TEXT_FINGERPRINT_PREFIX = 'text:'
+
+
+class TraceRecorder:
+    """Records the assistant turns of a test with a fingerprint of each tool result."""
+
+    def __init__(self):
+        self.turns: List[Dict[str, Any]] = []
+
+    def record_turn(self, content: List[Dict[str, Any]], tool_results: List[Dict[str, Any]]) -> None:
+        """
+        Records one assistant turn.
+
+        Args:
+            content: The assistant content blocks of the turn.
+            tool_results: The tool_result blocks sent back for the turn, in order.
+        """
+        self.turns.append({
+            # Round-trip through json so later edits to the messages can't leak in
+            'content': json.loads(json.dumps(content)),
+            'fingerprints': [result_fingerprint(result) for result in tool_results],
+        })
+
+    def save(self, key: str) -> None:
+        """Writes the recorded turns as gzipped JSON."""
+        path = _trace_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {'version': TRACE_VERSION, 'turns': self.turns}
+        path.write_bytes(gzip.compress(json.dumps(data, separators=(',', ':')).encode()))
+
+
+def trace_key(test_case: str, website_url: str) -> str:
+    """Traces are only valid for the same test case against the same website."""
+    return hashlib.sha256(f"{website_url}\n{test_case}".encode()).hexdigest()[:16]
+
+
+def load_trace(key: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Loads the recorded turns for a test.
+
+    Returns:
+        The turns, or None if there is no usable trace.
+    """
+    path = _trace_path(key)
+    if not path.exists():
+        return None
+    try:
+        data = json.loads(gzip.decompress(path.read_bytes()))
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != TRACE_VERSION:
+        return None
+    return data['turns']
+
+
+def result_fingerprint(tool_result: Dict[str, Any]) -> str:
+    """
+    Fingerprints a tool_result block: a difference hash of its screenshot, or an
+    exact hash of its text when it has no screenshot.
+    """
+    content = tool_result['content']
+    if isinstance(content, list):
+        for block in content:
+            if block['type'] == 'image':
+                return fingerprint(base64.b64decode(block['source']['data']))
+    text = json.dumps(content, sort_keys=True)
+    return TEXT_FINGERPRINT_PREFIX + hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def fingerprints_match(expected: Optional[str], actual: str) -> bool:
+    """Checks whether a live tool result still matches the recorded one."""
+    if expected is None:
+        return False
+    if expected.startswith(TEXT_FINGERPRINT_PREFIX) or actual.startswith(TEXT_FINGERPRINT_PREFIX):
+        return expected == actual
+    return fingerprint_distance(expected, actual) <= FINGERPRINT_TOLERANCE
+
+
+def _trace_path(key: str) -> Path:
+    return Path(TRACE_DIR) / f"{key}.json.gz"